@@ -0,0 +1,29 @@
+#!/usr/bin/env python
+
+
+import os
+
+from portal import app
+from portal.assets import build_assets, brotli
+from portal.bundles import build_bundles, rjsmin
+
+if __name__ == "__main__":
+    bundles = build_bundles(
+        os.path.join(app.root_path, app.template_folder), app.static_folder)
+    for name, bundle in sorted(bundles.items()):
+        # the figures are per layout: each page of it loads the same files
+        print('{0} bundle ({1}, {2} pages): {3} -> {4} bytes of local '
+              'CSS/JS per layout, {5} saved{6}'.format(
+                  name, bundle['layout'], len(bundle['pages']),
+                  bundle['original_bytes'], bundle['bundle_bytes'],
+                  bundle['original_bytes'] - bundle['bundle_bytes'],
+                  '' if rjsmin else ' (install rjsmin to minify scripts)'))
+        print('    render-blocking CSS per layout: {0} -> {1} bytes inline, '
+              '{2} bytes deferred'.format(bundle['blocking_css_bytes'],
+                                          bundle['inline_bytes'],
+                                          bundle['deferred_bytes']))
+        print('    pages: {0}'.format(', '.join(bundle['pages'])))
+    manifest = build_assets(app.static_folder)
+    print('{0} static files hashed into {1}/dist{2}'.format(
+        len(manifest['files']), app.static_folder,
+        '' if brotli else ' (install brotli for .br variants)'))
@@ -0,0 +1,11 @@
+#!/usr/bin/env python
+
+
+import sys
+from portal.freeze import freeze_public_pages
+
+if __name__ == "__main__":
+    rendered, unchanged, removed = freeze_public_pages(
+        force='--force' in sys.argv)
+    print('{0} pages rendered, {1} unchanged, {2} removed'.format(
+        rendered, unchanged, removed))
@@ -1,19 +1,26 @@
 from flask import Flask
 from flask_flatpages import FlatPages
-from flask_frozen import Freezer
+from portal.blog_index import ArticleIndex
+from portal.frozen import DirectoryIndexFreezer
+from portal.templating import configure_templates, precompile_templates
+from portal.assets import HashedStatic
+from portal.bundles import AssetBundles
+from portal.sessions import configure_sessions
 import logging.handlers
 import logging
+import os
 
-from vc3client import client
-from ConfigParser import SafeConfigParser
 # from flaskext.markdown import Markdown
 
 __author__ = 'Jeremy Van <jeremyvan@uchicago.edu>'
 
 
 app = Flask(__name__)
-app.config.from_pyfile('portal.conf')
-app.config['TEMPLATES_AUTO_RELOAD'] = True
+# VC3_PORTAL_CONFIG points elsewhere, e.g. at the tests' config
+app.config.from_pyfile(os.environ.get('VC3_PORTAL_CONFIG', 'portal.conf'))
+production_templates = configure_templates(app)
+# server-side sessions; the cookie only carries a session id
+session_metrics = configure_sessions(app)
 
 # set up logging
 handler = logging.handlers.RotatingFileHandler(
@@ -24,28 +31,24 @@ formatter = logging.Formatter('%(asctime)s - %(levelname)s: %(message)s')
 handler.setFormatter(formatter)
 
 pages = FlatPages(app)
-freezer = Freezer(app)
+articles = ArticleIndex(pages)
+# only the public pages listed in portal.freeze are exported
+freezer = DirectoryIndexFreezer(app, with_no_argument_rules=False,
+                                log_url_for=False)
 # Markdown(app)
 
-
-def get_vc3_client():
-    """
-    Return a VC3 client instance
-
-    :return: VC3 client instance on success
-    """
-    c = SafeConfigParser()
-    c.readfp(open(app.config['VC3_CLIENT_CONFIG']))
-
-    try:
-        client_api = client.VC3ClientAPI(c)
-        return client_api
-    except Exception as e:
-        app.logger.error("Couldn't get vc3 client: {0}".format(e))
-        raise
-
-app.jinja_env.globals.update(get_vc3_client=get_vc3_client)
+# templates get precomputed rows from the views, never a VC3 client
+from portal.view_models import reject_template_client
+app.jinja_env.globals.update(get_vc3_client=reject_template_client)
 
 # need to put this here since views uses the app object
 import portal.views
 import portal.rest_api
+
+# hashed, pre-compressed static files, if build_assets.py was run
+static_assets = HashedStatic(app)
+# per-layout stylesheet and script bundles, if build_assets.py made them
+asset_bundles = AssetBundles(app)
+
+if production_templates:
+    precompile_templates(app)
@@ -0,0 +1,232 @@
+import gzip
+import hashlib
+import json
+import mimetypes
+import os
+import posixpath
+import re
+import time
+
+from StringIO import StringIO
+
+from flask import request, send_from_directory
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+
+# Hashed copies of portal/static and their manifest live under static/dist
+DIST = 'dist'
+MANIFEST = 'assets-manifest.json'
+
+# Compressed variants are only worth it for text formats
+COMPRESSIBLE = ('.css', '.js', '.svg', '.json', '.ico', '.txt', '.html',
+                '.map', '.eot', '.ttf')
+
+ENCODING_SUFFIXES = {'br': '.br', 'gzip': '.gz'}
+
+CSS_URL = re.compile(r'''url\(\s*(['"]?)([^'")?#]+)([^'")]*)\1\s*\)''')
+
+# a year; hashed names change whenever the content does
+IMMUTABLE = 'public, max-age=31536000, immutable'
+
+# how long hashed files a build no longer lists are kept for the workers,
+# cached pages and frozen pages still linking them
+KEEP_SUPERSEDED = 7 * 24 * 3600
+
+
+def hashed_name(path, content):
+    """
+    :param path: path relative to the static folder, e.g. 'css/style.css'
+    :return: path with a content digest, e.g. 'css/style.0123456789.css'
+    """
+    root, ext = posixpath.splitext(path)
+    return '{0}.{1}{2}'.format(root, hashlib.sha1(content).hexdigest()[:10],
+                               ext)
+
+
+def compress(content):
+    """
+    :return: dict of encoding to compressed content, for each encoding
+        that saves bytes
+    """
+    variants = {}
+    buf = StringIO()
+    gz = gzip.GzipFile(filename='', mode='wb', fileobj=buf, mtime=0,
+                       compresslevel=9)
+    gz.write(content)
+    gz.close()
+    variants['gzip'] = buf.getvalue()
+    if brotli is not None:
+        variants['br'] = brotli.compress(content)
+    return dict((encoding, data) for encoding, data in variants.items()
+                if len(data) < len(content))
+
+
+def rewrite_css_urls(path, content, files):
+    """
+    Point url() references of a stylesheet at the hashed files
+
+    :param path: path of the stylesheet relative to the static folder
+    :param files: dict of static path to hashed path built so far
+    """
+    directory = posixpath.dirname(path)
+
+    def replace(match):
+        quote, target, suffix = match.groups()
+        if ':' in target or target.startswith('/'):
+            return match.group(0)
+        resolved = posixpath.normpath(posixpath.join(directory, target))
+        if resolved not in files:
+            return match.group(0)
+        relative = posixpath.relpath(files[resolved], directory)
+        return 'url({0}{1}{2}{0})'.format(quote, relative, suffix)
+    return CSS_URL.sub(replace, content)
+
+
+def _write(filename, data):
+    # renamed into place so nobody serves or reads a half written file
+    temp = filename + '.tmp'
+    with open(temp, 'wb') as fh:
+        fh.write(data)
+    os.rename(temp, filename)
+
+
+def prune_assets(dist, keep, referenced):
+    """
+    Remove the hashed files of earlier builds that no build listed for
+    keep seconds
+
+    Files of the current build are touched on every build, so the mtime of
+    a superseded file is when it was last listed.
+
+    :param referenced: set of paths relative to dist to keep regardless
+    :return: number of files removed
+    """
+    cutoff = time.time() - keep
+    removed = 0
+    for directory, dirnames, filenames in os.walk(dist):
+        for filename in filenames:
+            path = os.path.join(directory, filename)
+            relative = os.path.relpath(path, dist).replace(os.sep, '/')
+            if relative in referenced or os.path.getmtime(path) > cutoff:
+                continue
+            os.remove(path)
+            removed += 1
+    return removed
+
+
+def build_assets(static_folder, keep=KEEP_SUPERSEDED):
+    """
+    Write content-hashed, pre-compressed copies of every static file to
+    static/dist together with a manifest
+
+    Stylesheets are handled last so their url() references can point at
+    hashed images and fonts.  Files of earlier builds stay in place, since
+    running workers and pages rendered before still link them, until
+    they were left out of every build for keep seconds.
+
+    :param static_folder: the app's static folder
+    :param keep: seconds superseded hashed files are kept
+    :return: the manifest written
+    """
+    sources = []
+    for directory, dirnames, filenames in os.walk(static_folder):
+        relative_dir = os.path.relpath(directory, static_folder)
+        if relative_dir == DIST:
+            dirnames[:] = []
+            continue
+        for filename in filenames:
+            path = posixpath.normpath(posixpath.join(
+                relative_dir.replace(os.sep, '/'), filename))
+            sources.append(path)
+    sources.sort(key=lambda p: (p.endswith('.css'), p))
+
+    dist = os.path.join(static_folder, DIST)
+    files = {}
+    encodings = {}
+    referenced = set([MANIFEST])
+    for path in sources:
+        with open(os.path.join(static_folder, *path.split('/')), 'rb') as fh:
+            content = fh.read()
+        if path.endswith('.css'):
+            content = rewrite_css_urls(path, content, files)
+        target = posixpath.join(DIST, hashed_name(path, content))
+        filename = os.path.join(static_folder, *target.split('/'))
+        if not os.path.isdir(os.path.dirname(filename)):
+            os.makedirs(os.path.dirname(filename))
+        variants = {}
+        if path.lower().endswith(COMPRESSIBLE):
+            variants = compress(content)
+        outputs = [(filename, content)]
+        outputs.extend((filename + ENCODING_SUFFIXES[encoding], data)
+                       for encoding, data in variants.items())
+        for output, data in outputs:
+            if os.path.isfile(output):
+                # same name, same content; only mark it as current
+                os.utime(output, None)
+            else:
+                _write(output, data)
+            referenced.add(os.path.relpath(output, dist).replace(os.sep, '/'))
+        files[path] = target
+        encodings[target] = sorted(variants)
+
+    manifest = {'files': files, 'encodings': encodings}
+    _write(os.path.join(dist, MANIFEST),
+           json.dumps(manifest, indent=2, sort_keys=True))
+    prune_assets(dist, keep, referenced)
+    return manifest
+
+
+class HashedStatic(object):
+    """
+    Serve static files under their hashed names when a manifest was built
+
+    url_for('static', filename=...) emits the hashed name, and hashed files
+    are sent with far-future immutable caching, in the pre-compressed
+    variant the browser accepts.  Without a manifest the app serves static
+    files as usual.
+    """
+
+    def __init__(self, app):
+        self.app = app
+        self.files = {}
+        self.encodings = {}
+        manifest_path = os.path.join(app.static_folder, DIST, MANIFEST)
+        if not os.path.isfile(manifest_path):
+            return
+        with open(manifest_path) as fh:
+            manifest = json.load(fh)
+        self.files = manifest['files']
+        self.encodings = manifest['encodings']
+        app.url_defaults(self.hashed_url)
+        app.view_functions['static'] = self.send_static_file
+        app.logger.info("Serving {0} hashed static files".format(
+            len(self.files)))
+
+    def hashed_url(self, endpoint, values):
+        if endpoint == 'static' and values.get('filename') in self.files:
+            values['filename'] = self.files[values['filename']]
+
+    def send_static_file(self, filename):
+        if filename not in self.encodings:
+            return self.app.send_static_file(filename)
+        mimetype = mimetypes.guess_type(filename)[0]
+        response = None
+        for encoding in ('br', 'gzip'):
+            if (encoding in self.encodings[filename] and
+                    request.accept_encodings[encoding]):
+                response = send_from_directory(
+                    self.app.static_folder,
+                    filename + ENCODING_SUFFIXES[encoding],
+                    mimetype=mimetype)
+                response.headers['Content-Encoding'] = encoding
+                break
+        if response is None:
+            response = send_from_directory(self.app.static_folder, filename,
+                                           mimetype=mimetype)
+        response.headers['Cache-Control'] = IMMUTABLE
+        response.headers['Vary'] = 'Accept-Encoding'
+        return response
@@ -0,0 +1,115 @@
+import threading
+import time
+
+
+class UserGrants(object):
+    """
+    What one user may access, derived from the project and allocation
+    collections
+    """
+
+    def __init__(self):
+        self.projects = set()
+        self.project_owners = set()
+        self.ready_allocations = set()
+
+
+class Authorizer(object):
+    """
+    Cached answers to the portal's project and allocation access checks
+
+    Grants for every user are built in one pass over listProjects and
+    listAllocations and kept for ttl seconds.  They are also dropped as
+    soon as the shared entity cache invalidates projects or allocations,
+    i.e. after any membership or allocation change made through the
+    portal, so each check is a set lookup while the grants are warm.
+    """
+
+    def __init__(self, cache, ttl=15):
+        self.cache = cache
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._grants = {}
+        self._expires = 0
+        self._generations = None
+        self.builds = 0
+        self.checks = 0
+
+    def _current_generations(self):
+        return (self.cache.generation('project'),
+                self.cache.generation('allocation'))
+
+    def grants(self, vc3_client, user):
+        """
+        Return the grants of user, rebuilding them if they went stale
+
+        :param vc3_client: VC3 client used to list projects and allocations
+        :param user: name of the user
+        :return: UserGrants
+        """
+        generations = self._current_generations()
+        with self._lock:
+            self.checks += 1
+            if (self._generations == generations and
+                    self._expires > time.time()):
+                return self._grants.get(user) or UserGrants()
+
+        grants = {}
+        for project in vc3_client.listProjects():
+            for member in [project.owner] + list(project.members or []):
+                user_grants = grants.setdefault(member, UserGrants())
+                user_grants.projects.add(project.name)
+                user_grants.project_owners.add(project.owner)
+        for allocation in vc3_client.listAllocations():
+            if allocation.state == 'ready':
+                grants.setdefault(allocation.owner, UserGrants()) \
+                    .ready_allocations.add(allocation.name)
+
+        with self._lock:
+            # a write that raced with the listing leaves the grants stale
+            if generations == self._current_generations():
+                self._grants = grants
+                self._generations = generations
+                self._expires = time.time() + self.ttl
+                self.builds += 1
+        return grants.get(user) or UserGrants()
+
+    def has_ready_allocation(self, vc3_client, user):
+        """
+        :return: True if user owns at least one ready allocation
+        """
+        return bool(self.grants(vc3_client, user).ready_allocations)
+
+    def in_any_project(self, vc3_client, user):
+        """
+        :return: True if user owns or is a member of at least one project
+        """
+        return bool(self.grants(vc3_client, user).projects)
+
+    def in_project(self, vc3_client, user, name):
+        """
+        :return: True if user owns or is a member of project name
+        """
+        return name in self.grants(vc3_client, user).projects
+
+    def in_vc(self, vc3_client, user, name):
+        """
+        Check whether user shares a project with the owner of a virtual
+        cluster
+
+        :param name: name of the virtual cluster; a missing one raises the
+            VC3 client's lookup error
+        :return: True if user owns or is a member of any project owned by
+            the virtual cluster's owner
+        """
+        # not kept here: a deleted cluster's name may be reused by another
+        # user, and the entity cache already drops requests on every write
+        owner = vc3_client.getRequest(requestname=name).owner
+        return owner in self.grants(vc3_client, user).project_owners
+
+    def stats(self):
+        with self._lock:
+            return {'users': len(self._grants),
+                    'builds': self.builds,
+                    'checks': self.checks,
+                    'ttl': self.ttl}
@@ -0,0 +1,93 @@
+import threading
+
+
+class ArticleIndex(object):
+    """
+    Blog articles and tags, indexed once per FlatPages load
+
+    Articles are the pages with a publication date, kept newest first.
+    Every page is also indexed under each of its tags.  The index is rebuilt
+    only when a FlatPages reload actually produced new pages, e.g. after a
+    page file changed with FLATPAGES_AUTO_RELOAD on.
+    """
+
+    def __init__(self, pages):
+        self.pages = pages
+        self._lock = threading.Lock()
+        self._source = None
+        self._page_ids = None
+        self._articles = []
+        self._tags = {}
+        self._sidebars = {}
+        self.builds = 0
+
+    def _current(self):
+        # FlatPages replaces its page dict on every reload, but hands back
+        # the same Page objects for files that did not change
+        source = self.pages._pages
+        with self._lock:
+            if source is not self._source:
+                pages = set(id(p) for p in source.values())
+                if pages != self._page_ids:
+                    self._build(source)
+                    self._page_ids = pages
+                # keep the pages alive so their ids are not reused
+                self._source = source
+            return self._articles, self._tags, self._sidebars
+
+    def _build(self, source):
+        articles = sorted((p for p in source.values() if 'date' in p.meta),
+                          reverse=True, key=lambda p: p.meta['date'])
+        dated = set(id(p) for p in articles)
+        tags = {}
+        for p in articles + [p for p in source.values() if id(p) not in dated]:
+            seen = set()
+            for tag in p.meta.get('tags') or []:
+                if tag not in seen:
+                    seen.add(tag)
+                    tags.setdefault(tag, []).append(p)
+        self._articles = articles
+        self._tags = tags
+        self._sidebars = {}
+        self.builds += 1
+
+    def latest(self, count):
+        """
+        :param count: number of articles
+        :return: list of the count most recent articles, newest first
+        """
+        return self._current()[0][:count]
+
+    def tagged(self, tag):
+        """
+        :param tag: tag name
+        :return: list of pages with that tag, dated articles newest first
+        """
+        return self._current()[1].get(tag, [])
+
+    def tags(self):
+        """
+        :return: sorted list of every tag used by a page
+        """
+        return sorted(self._current()[1])
+
+    def sidebar(self, count):
+        """
+        Tags of the count most recent articles, for the blog sidebar
+
+        :param count: number of articles
+        :return: list of (tag, articles) tuples, one per distinct first tag
+            of those articles, each with the articles carrying that tag
+        """
+        articles, tags, sidebars = self._current()
+        if count not in sidebars:
+            latest = articles[:count]
+            first_tags = []
+            for p in latest:
+                page_tags = p.meta.get('tags') or []
+                if page_tags and page_tags[0] not in first_tags:
+                    first_tags.append(page_tags[0])
+            sidebars[count] = [(tag, [p for p in latest
+                                      if tag in p.meta.get('tags', [])])
+                               for tag in first_tags]
+        return sidebars[count]
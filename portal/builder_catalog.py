@@ -0,0 +1,135 @@
+import os
+import subprocess
+import threading
+import time
+
+from collections import OrderedDict
+
+from portal import app
+
+
+class BuilderCatalog(object):
+    """
+    Recipes, recipe sections and operating systems known to vc3-builder
+    """
+
+    def __init__(self, recipes, sections, oss):
+        self.recipes = recipes
+        self.sections = sections
+        self.oss = oss
+
+
+def parse_sections(output):
+    """
+    Group the output of vc3-builder --list=section
+
+    :param output: lines of '--- section name' headers, each followed by
+        the recipes in that section
+    :return: OrderedDict of section name to list of recipes
+    """
+    sections = OrderedDict()
+    recipes = sections.setdefault('', [])
+    for line in output.splitlines():
+        line = line.strip()
+        if line.startswith('---'):
+            recipes = sections.setdefault(line.lstrip('- ').strip(), [])
+        elif line:
+            recipes.extend(line.split())
+    if not sections['']:
+        del sections['']
+    return sections
+
+
+class BuilderCatalogService(object):
+    """
+    Loads the vc3-builder catalogs once and serves them from memory
+
+    The catalogs are reloaded when the vc3-builder binary changes (by
+    mtime) or after ttl seconds.  One thread reloads while the others keep
+    serving the last catalog; only the very first load is waited for.  If
+    a reload fails, the last good catalog keeps being served and the
+    reload is retried after retry seconds.
+    """
+
+    def __init__(self, builder='/usr/bin/vc3-builder', ttl=3600, retry=60):
+        self.builder = builder
+        self.ttl = ttl
+        self.retry = retry
+        self._lock = threading.Lock()
+        self._load_lock = threading.Lock()
+        self._catalog = None
+        self._mtime = None
+        self._expires = 0
+        self.loads = 0
+        self.failures = 0
+
+    def _list(self, *args):
+        return subprocess.check_output([self.builder] + list(args))
+
+    def _load(self):
+        recipes = self._list('--list').split()
+        sections = parse_sections(self._list('--list=section'))
+        oss = self._list('--list=os').split()
+        return BuilderCatalog(recipes, sections, oss)
+
+    def _current(self, mtime):
+        return (self._catalog is not None and mtime == self._mtime and
+                self._expires > time.time())
+
+    def get(self):
+        """
+        Return the current catalog, reloading it if it went stale
+
+        :return: BuilderCatalog
+        :raises: OSError or subprocess.CalledProcessError if no catalog
+            could be loaded yet
+        """
+        try:
+            mtime = os.path.getmtime(self.builder)
+        except OSError:
+            mtime = None
+        with self._lock:
+            catalog = self._catalog
+            if self._current(mtime):
+                return catalog
+        # wait for a reload in progress only when there is nothing to serve
+        if not self._load_lock.acquire(catalog is None):
+            return catalog
+        try:
+            with self._lock:
+                if self._current(mtime):
+                    return self._catalog
+            start = time.time()
+            try:
+                catalog = self._load()
+            except (OSError, subprocess.CalledProcessError) as e:
+                with self._lock:
+                    self.failures += 1
+                    self._mtime = mtime
+                    self._expires = time.time() + self.retry
+                    catalog = self._catalog
+                if catalog is None:
+                    raise
+                app.logger.error("Couldn't reload vc3-builder catalog, "
+                                 "serving the last one: {0}".format(e))
+                return catalog
+            with self._lock:
+                self._catalog = catalog
+                self.loads += 1
+                self._mtime = mtime
+                self._expires = time.time() + self.ttl
+            app.logger.info("Loaded vc3-builder catalog: {0} recipes, {1} "
+                            "sections, {2} operating systems in "
+                            "{3:.2f}s".format(len(catalog.recipes),
+                                              len(catalog.sections),
+                                              len(catalog.oss),
+                                              time.time() - start))
+            return catalog
+        finally:
+            self._load_lock.release()
+
+    def stats(self):
+        with self._lock:
+            return {'loaded': self._catalog is not None,
+                    'loads': self.loads,
+                    'failures': self.failures}
@@ -0,0 +1,384 @@
+import json
+import os
+import posixpath
+import re
+
+from flask import url_for
+from jinja2 import Markup
+
+from portal.assets import CSS_URL
+
+try:
+    import rjsmin
+except ImportError:
+    rjsmin = None
+
+
+# Locally served stylesheets and scripts of each layout, in page order
+BUNDLES = {'site': {'layout': 'base.html',
+                    'css': ['css/jarostyle.css'],
+                    'js': ['js/custom.js']},
+           'portal': {'layout': 'loginbase.html',
+                      'css': ['css/light-bootstrap-dashboard.css'],
+                      'js': ['js/custom.js']}}
+
+# Bundles and their manifest live under static/bundles
+BUNDLE_DIR = 'bundles'
+MANIFEST = 'bundles.json'
+
+# Classes added at runtime by Bootstrap, Chartist and the notification
+# plugins; rules using them are kept even though no template mentions them
+SAFELIST = ('active', 'animated', 'collapse', 'collapsing', 'disabled',
+            'fade', 'in', 'open', 'show')
+SAFELIST_PREFIXES = ('bootstrap-', 'bs-', 'ct-', 'modal', 'popover',
+                     'tooltip')
+
+STRINGS = re.compile(r'''"(?:\\.|[^"\\])*"|'(?:\\.|[^'\\])*\'''')
+WORDS = re.compile(r'[A-Za-z0-9_-]+')
+SELECTOR_TOKENS = re.compile(r'[.#](-?[_A-Za-z][_A-Za-z0-9-]*)')
+# contents of :not(...) and [attribute] selectors never have to be present
+SELECTOR_IGNORED = re.compile(r':not\([^)]*\)|\[[^\]]*\]')
+# at-rules whose blocks hold rules to purge, as opposed to @font-face etc.
+NESTED_AT_RULES = ('@media', '@supports', '@document')
+
+
+def _skip_string(css, i):
+    quote = css[i]
+    i += 1
+    while i < len(css) and css[i] != quote:
+        i += 2 if css[i] == '\\' else 1
+    return i
+
+
+def _find(css, start, delimiters):
+    """
+    :return: index of the first delimiter outside strings and parentheses
+        at or after start, or -1
+    """
+    depth = 0
+    i = start
+    while i < len(css):
+        c = css[i]
+        if c in '"\'':
+            i = _skip_string(css, i)
+        elif c == '(':
+            depth += 1
+        elif c == ')':
+            depth -= 1
+        elif depth == 0 and c in delimiters:
+            return i
+        i += 1
+    return -1
+
+
+def _closing_brace(css, start):
+    depth = 0
+    i = start
+    while i < len(css):
+        c = css[i]
+        if c in '"\'':
+            i = _skip_string(css, i)
+        elif c == '{':
+            depth += 1
+        elif c == '}':
+            depth -= 1
+            if depth == 0:
+                return i
+        i += 1
+    return len(css)
+
+
+def strip_comments(css):
+    """
+    :return: tuple of (stylesheet without comments, list of /*! ... */
+        license comments to keep)
+    """
+    licenses = []
+    parts = []
+    last = 0
+    i = 0
+    while i < len(css):
+        if css[i] in '"\'':
+            i = _skip_string(css, i) + 1
+            continue
+        if css.startswith('/*', i):
+            end = css.find('*/', i + 2)
+            end = len(css) if end == -1 else end + 2
+            if css.startswith('/*!', i):
+                licenses.append(css[i:end])
+            parts.append(css[last:i])
+            last = i = end
+            continue
+        i += 1
+    parts.append(css[last:])
+    return ''.join(parts), licenses
+
+
+def parse_rules(css):
+    """
+    Split a stylesheet without comments into its top-level statements
+
+    :return: list of (prelude, block) tuples; block is None for statements
+        such as @import and @charset
+    """
+    rules = []
+    i = 0
+    while i < len(css):
+        j = _find(css, i, '{;}')
+        if j == -1:
+            break
+        prelude = css[i:j].strip()
+        if css[j] == '{':
+            k = _closing_brace(css, j)
+            rules.append((prelude, css[j + 1:k]))
+            i = k + 1
+        else:
+            if css[j] == ';' and prelude:
+                rules.append((prelude, None))
+            i = j + 1
+    return rules
+
+
+def split_selectors(prelude):
+    selectors = []
+    while True:
+        i = _find(prelude, 0, ',')
+        if i == -1:
+            selectors.append(prelude.strip())
+            return [s for s in selectors if s]
+        selectors.append(prelude[:i].strip())
+        prelude = prelude[i + 1:]
+
+
+def selector_tokens(selector):
+    """
+    :return: set of the class names and ids a selector requires
+    """
+    return set(SELECTOR_TOKENS.findall(SELECTOR_IGNORED.sub('', selector)))
+
+
+def minify_block(block):
+    """
+    Collapse whitespace in declarations, leaving strings untouched
+    """
+    parts = []
+    last = 0
+    for match in STRINGS.finditer(block):
+        parts.append(_minify_plain(block[last:match.start()]))
+        parts.append(match.group(0))
+        last = match.end()
+    parts.append(_minify_plain(block[last:]))
+    return ''.join(parts).strip().rstrip(';')
+
+
+def _minify_plain(text):
+    text = re.sub(r'\s+', ' ', text)
+    return re.sub(r' ?([:;,{}>]) ?', r'\1', text).replace(';}', '}')
+
+
+def minify_selector(selector):
+    selector = re.sub(r'\s+', ' ', selector)
+    return re.sub(r' ?([>~+]) ?', r'\1', selector)
+
+
+def select_rules(rules, keep, at_rules=True):
+    """
+    Keep the selectors of rules that keep() accepts, recursing into @media
+    blocks and dropping rules and blocks left empty
+
+    :param keep: function of a set of selector tokens to a bool
+    :param at_rules: keep @keyframes, @font-face and the like
+    :return: minified stylesheet text
+    """
+    out = []
+    for prelude, block in rules:
+        if block is None:
+            out.append(minify_selector(prelude) + ';')
+        elif prelude.startswith(NESTED_AT_RULES):
+            inner = select_rules(parse_rules(block), keep, at_rules)
+            if inner:
+                out.append('{0}{{{1}}}'.format(minify_selector(prelude),
+                                               inner))
+        elif prelude.startswith('@'):
+            if not at_rules:
+                continue
+            out.append('{0}{{{1}}}'.format(
+                minify_selector(prelude), minify_block(block)))
+        else:
+            selectors = [s for s in split_selectors(prelude)
+                         if keep(selector_tokens(s))]
+            declarations = minify_block(block)
+            if selectors and declarations:
+                out.append('{0}{{{1}}}'.format(
+                    ','.join(minify_selector(s) for s in selectors),
+                    declarations))
+    return ''.join(out)
+
+
+def template_words(template_folder, static_folder):
+    """
+    Every word in the templates and local scripts, i.e. every class name
+    or id the pages can carry
+    """
+    words = set()
+    for folder, suffix in ((template_folder, '.html'),
+                           (os.path.join(static_folder, 'js'), '.js')):
+        for directory, dirnames, filenames in os.walk(folder):
+            for filename in filenames:
+                if filename.endswith(suffix):
+                    with open(os.path.join(directory, filename)) as fh:
+                        words.update(WORDS.findall(fh.read()))
+    return words
+
+
+def _read(static_folder, path):
+    with open(os.path.join(static_folder, *path.split('/'))) as fh:
+        return fh.read()
+
+
+def layout_pages(template_folder, layout):
+    """
+    :return: sorted list of the templates extending layout
+    """
+    extends = re.compile(r'''{%-?\s*extends\s+["']''' + re.escape(layout) +
+                         r'''["']''')
+    found = []
+    for filename in sorted(os.listdir(template_folder)):
+        if filename.endswith('.html'):
+            with open(os.path.join(template_folder, filename)) as fh:
+                if extends.search(fh.read()):
+                    found.append(filename)
+    return found
+
+
+def build_bundles(template_folder, static_folder, bundles=BUNDLES):
+    """
+    Write one minified stylesheet and one script per layout to
+    static/bundles, with the critical stylesheet rules of each layout
+
+    Stylesheet rules whose class names or ids appear in neither the
+    templates nor the local scripts are dropped, short of the SAFELIST.
+    Critical rules are those the layout template itself uses, i.e. the
+    page frame shown before any content; they are inlined into the page.
+    Run build_assets afterwards so the bundles are fingerprinted too.
+
+    :return: dict of bundle name to manifest entry, including the bytes of
+        the original files and of the bundle, and the render-blocking
+        stylesheet bytes of every page of the layout before and after
+    """
+    words = template_words(template_folder, static_folder)
+
+    def used(tokens):
+        return all(t in words or t in SAFELIST or
+                   t.startswith(SAFELIST_PREFIXES) for t in tokens)
+
+    out_dir = os.path.join(static_folder, BUNDLE_DIR)
+    if not os.path.isdir(out_dir):
+        os.makedirs(out_dir)
+    manifest = {}
+    for name, spec in sorted(bundles.items()):
+        with open(os.path.join(template_folder, spec['layout'])) as fh:
+            frame = set(WORDS.findall(fh.read()))
+
+        def critical(tokens):
+            return used(tokens) and all(t in frame for t in tokens)
+
+        originals = [_read(static_folder, path)
+                     for path in spec['css'] + spec['js']]
+        original_css = sum(len(_read(static_folder, path))
+                           for path in spec['css'])
+        licenses = []
+        rules = []
+        for path in spec['css']:
+            css, kept = strip_comments(_read(static_folder, path))
+            licenses.extend(kept)
+            # url() references stay valid since bundles sit one directory
+            # below static, like css/
+            rules.extend(parse_rules(css))
+        stylesheet = '\n'.join(licenses + [select_rules(rules, used)])
+        above_fold = select_rules(rules, critical, at_rules=False)
+
+        scripts = [_read(static_folder, path) for path in spec['js']]
+        if rjsmin is not None:
+            scripts = [rjsmin.jsmin(s) for s in scripts]
+        script = ';\n'.join(s.strip().rstrip(';') for s in scripts) + ';\n'
+
+        entry = {'css': '{0}/{1}.css'.format(BUNDLE_DIR, name),
+                 'js': '{0}/{1}.js'.format(BUNDLE_DIR, name),
+                 'critical': above_fold,
+                 'layout': spec['layout'],
+                 'original_bytes': sum(len(o) for o in originals),
+                 'bundle_bytes': (len(stylesheet) + len(script) +
+                                  len(above_fold)),
+                 # every page of the layout links the same files, so a
+                 # page blocks on the original stylesheets before and
+                 # on the inline critical rules only after
+                 'blocking_css_bytes': original_css,
+                 'inline_bytes': len(above_fold),
+                 'deferred_bytes': len(stylesheet),
+                 'pages': layout_pages(template_folder, spec['layout'])}
+        for path, content in ((entry['css'], stylesheet),
+                              (entry['js'], script)):
+            with open(os.path.join(static_folder, *path.split('/')),
+                      'w') as fh:
+                fh.write(content)
+        manifest[name] = entry
+
+    with open(os.path.join(out_dir, MANIFEST), 'w') as fh:
+        json.dump(manifest, fh, indent=2, sort_keys=True)
+    return manifest
+
+
+class AssetBundles(object):
+    """
+    Stylesheet and script tags of the layout bundles, for the templates
+
+    When no bundles were built, built() is False and the layouts link the
+    original files.
+    """
+
+    def __init__(self, app):
+        self.bundles = {}
+        manifest_path = os.path.join(app.static_folder, BUNDLE_DIR, MANIFEST)
+        if os.path.isfile(manifest_path):
+            with open(manifest_path) as fh:
+                self.bundles = json.load(fh)
+            app.logger.info("Serving asset bundles for {0}".format(
+                ', '.join(sorted(self.bundles))))
+        app.jinja_env.globals['asset_bundles'] = self
+
+    def built(self, name):
+        return name in self.bundles
+
+    def critical(self, name):
+        """
+        :return: the critical rules of a bundle, with url() references
+            resolved against the static folder since they end up inline
+        """
+        def absolute(match):
+            quote, target, suffix = match.groups()
+            if ':' in target or target.startswith('/'):
+                return match.group(0)
+            path = posixpath.normpath(posixpath.join(BUNDLE_DIR, target))
+            return 'url({0}{1}{2}{0})'.format(
+                quote, url_for('static', filename=path), suffix)
+        return CSS_URL.sub(absolute, self.bundles[name]['critical'])
+
+    def stylesheet(self, name):
+        """
+        :return: the critical rules inline and the full bundle loaded
+            without blocking rendering
+        """
+        href = url_for('static', filename=self.bundles[name]['css'])
+        return Markup(
+            u'<style>{0}</style>\n'
+            u'<link rel="preload" href="{1}" as="style" '
+            u'onload="this.onload=null;this.rel=\'stylesheet\'">\n'
+            u'<noscript><link rel="stylesheet" type="text/css" href="{1}">'
+            u'</noscript>').format(Markup(self.critical(name).replace(
+                '</', '<\\/')), href)
+
+    def script(self, name):
+        return Markup(u'<script type="text/javascript" src="{0}"></script>'
+                      ).format(url_for('static',
+                                       filename=self.bundles[name]['js']))
@@ -0,0 +1,496 @@
+import copy
+import re
+import threading
+import time
+
+from collections import OrderedDict
+
+from flask import g, has_request_context
+
+
+# addUserToProject, removeAllocationFromProject, addNodesetToCluster, ...
+MEMBERSHIP_CALL = re.compile(
+    r'^(?:add|remove)([A-Z]\w*?)(?:To|From)([A-Z]\w*)$')
+
+
+def entity_kind(name):
+    """
+    Normalise the entity part of a client method name
+
+    :param name: entity part of the method, e.g. 'Projects' or 'Nodeinfo'
+    :return: lower case singular entity kind, e.g. 'project'
+    """
+    kind = name.lower()
+    if kind.endswith('ies'):
+        return kind[:-3] + 'y'
+    if kind.endswith('s'):
+        return kind[:-1]
+    return kind
+
+
+def classify_call(attr):
+    """
+    Work out how a VC3 client method touches the infoservice
+
+    :param attr: name of the VC3 client method
+    :return: tuple of (operation, kinds), operation being one of 'list',
+        'get', 'write' or None for calls that are passed straight through
+    """
+    if attr.startswith('list') and len(attr) > 4:
+        return 'list', (entity_kind(attr[4:]),)
+    if attr.startswith('get') and len(attr) > 3:
+        return 'get', (entity_kind(attr[3:]),)
+    if attr.startswith('store') and len(attr) > 5:
+        return 'write', (entity_kind(attr[5:]),)
+    if attr.startswith('delete') and len(attr) > 6:
+        return 'write', (entity_kind(attr[6:]),)
+    if attr == 'terminateRequest':
+        return 'write', ('request',)
+    match = MEMBERSHIP_CALL.match(attr)
+    if match:
+        return 'write', tuple(entity_kind(k) for k in match.groups())
+    return None, ()
+
+
+def single_argument(args, kwargs):
+    """
+    Return the lone argument of a get* call, or None if there is not
+    exactly one
+    """
+    if len(args) + len(kwargs) != 1:
+        return None
+    if args:
+        return args[0]
+    return list(kwargs.values())[0]
+
+
+# ages of data served outside a request, e.g. in a fan-out worker, until
+# the request thread collects them with pop_snapshot_age()
+_snapshot_ages = threading.local()
+
+
+def record_snapshot_age(age):
+    """
+    Remember the age of the oldest cached data served to this request
+
+    Outside a request the age is kept for the calling thread instead,
+    for pop_snapshot_age().
+
+    :param age: seconds since the served data was fetched, 0 for data
+        fetched just now
+    """
+    if has_request_context():
+        g.vc3_snapshot_age = max(getattr(g, 'vc3_snapshot_age', 0), age)
+    else:
+        _snapshot_ages.age = max(getattr(_snapshot_ages, 'age', 0), age)
+
+
+def pop_snapshot_age():
+    """
+    Return and forget the age of the oldest data the calling thread served
+    outside a request
+
+    :return: age in seconds, or None if no data was served
+    """
+    age = getattr(_snapshot_ages, 'age', None)
+    _snapshot_ages.age = None
+    return age
+
+
+class EntityCollection(list):
+    """
+    List of VC3 entities with O(1) lookups by name and secondary keys
+
+    Behaves like the plain list the VC3 client returns.  Each index is
+    built on first use and kept for the life of the collection, so build
+    one collection per snapshot and do not change indexed attributes of
+    its entities afterwards.  A collection cached in an EntityCache is
+    shared with its indexes by every request reading it.
+    """
+
+    def __init__(self, entities=()):
+        super(EntityCollection, self).__init__(entities)
+        self._indexes = {}
+
+    def _index_on(self, key):
+        index = self._indexes.get(key)
+        if index is None:
+            index = {}
+            for entity in self:
+                index.setdefault(getattr(entity, key, None), []).append(entity)
+            self._indexes[key] = index
+        return index
+
+    def get(self, name, default=None):
+        """
+        Return the entity with the given name
+
+        :param name: name attribute of the entity
+        :param default: value returned when there is no such entity
+        :return: matching entity or default
+        """
+        return self.lookup('name', name, default)
+
+    def lookup(self, key, value, default=None):
+        """
+        Return the first entity whose attribute key equals value
+
+        :param key: attribute to match, e.g. 'displayname' or 'identity_id'
+        :param value: value the attribute must have
+        :param default: value returned when nothing matches
+        :return: matching entity or default
+        """
+        matches = self._index_on(key).get(value)
+        if matches:
+            return matches[0]
+        return default
+
+    def filter_by(self, key, value):
+        """
+        Return every entity whose attribute key equals value
+
+        :param key: attribute to match, e.g. 'owner'
+        :param value: value the attribute must have
+        :return: EntityCollection of matching entities
+        """
+        return EntityCollection(self._index_on(key).get(value, ()))
+
+    def __deepcopy__(self, memo):
+        entities = EntityCollection(copy.deepcopy(list(self), memo))
+        # memo maps every entity to its copy, so the indexes carry over
+        # without being rebuilt
+        entities._indexes = copy.deepcopy(self._indexes, memo)
+        return entities
+
+
+def as_collection(entities):
+    """
+    Wrap a list* result in an EntityCollection unless it already is one
+    """
+    if isinstance(entities, EntityCollection):
+        return entities
+    return EntityCollection(entities)
+
+
+class RequestScopedClient(object):
+    """
+    Per-request memo in front of a VC3 client
+
+    Within one HTTP request every list* collection is fetched at most once
+    and every get* entity at most once; get* lookups are answered out of an
+    already fetched list* result when there is one.  store*, delete* and
+    membership calls drop the memo for the entity kinds they touch, so
+    later reads in the same request see the new state.
+
+    list* collections may be the shared snapshots of an EntityCache and
+    must not be changed; a get* entity taken from one is copied first, as
+    views change get* results before storing them.
+    """
+
+    def __init__(self, client_api):
+        self._client = client_api
+        self._lists = {}
+        self._entities = {}
+
+    def __getattr__(self, attr):
+        method = getattr(self._client, attr)
+        operation, kinds = classify_call(attr)
+        if operation == 'list':
+            return self._memo_list(method, kinds[0])
+        if operation == 'get':
+            return self._memo_get(method, kinds[0])
+        if operation == 'write':
+            return self._invalidating(method, kinds)
+        return method
+
+    def _memo_list(self, method, kind):
+        def list_entities(*args, **kwargs):
+            if args or kwargs:
+                return method(*args, **kwargs)
+            if kind not in self._lists:
+                self._lists[kind] = as_collection(method())
+            return self._lists[kind]
+        return list_entities
+
+    def _memo_get(self, method, kind):
+        def get_entity(*args, **kwargs):
+            name = single_argument(args, kwargs)
+            if name is None:
+                return method(*args, **kwargs)
+            key = (kind, name)
+            if key not in self._entities:
+                entity = self._from_list(kind, name)
+                if entity is None:
+                    entity = method(*args, **kwargs)
+                self._entities[key] = entity
+            return self._entities[key]
+        return get_entity
+
+    def _from_list(self, kind, name):
+        entities = self._lists.get(kind)
+        if entities is None:
+            return None
+        entity = entities.get(name)
+        if entity is not None:
+            entity = copy.deepcopy(entity)
+        return entity
+
+    def _invalidating(self, method, kinds):
+        def write(*args, **kwargs):
+            try:
+                return method(*args, **kwargs)
+            finally:
+                self.invalidate(*kinds)
+        return write
+
+    def _memo_key(self, attr, args, kwargs):
+        operation, kinds = classify_call(attr)
+        if operation == 'list' and not (args or kwargs):
+            return kinds[0], None
+        if operation == 'get':
+            name = single_argument(args, kwargs)
+            if name is not None:
+                return kinds[0], name
+        return None
+
+    def _memoized(self, key):
+        kind, name = key
+        if name is None:
+            return self._lists.get(kind)
+        entity = self._entities.get(key)
+        if entity is None:
+            entity = self._from_list(kind, name)
+            if entity is not None:
+                self._entities[key] = entity
+        return entity
+
+    def fetch_many(self, run, calls):
+        """
+        Answer several independent list* and get* calls at once
+
+        Calls the memo can already answer are not issued again; the rest
+        are handed to run together and their results memoized, so later
+        calls in this request are served locally.
+
+        :param run: callable issuing a list of calls and returning their
+            results in order, e.g. FanOut.run
+        :param calls: list of (method name, args, kwargs) tuples
+        :return: list of results, in the order of calls
+        """
+        results = [None] * len(calls)
+        missing = []
+        for i, (attr, args, kwargs) in enumerate(calls):
+            key = self._memo_key(attr, args, kwargs)
+            value = None
+            if key is not None:
+                value = self._memoized(key)
+            if value is None:
+                missing.append(i)
+            else:
+                results[i] = value
+        fetched = run([calls[i] for i in missing])
+        for i, value in zip(missing, fetched):
+            key = self._memo_key(*calls[i])
+            if key is not None and key[1] is None:
+                value = self._lists[key[0]] = as_collection(value)
+            elif key is not None:
+                self._entities[key] = value
+            results[i] = value
+        return results
+
+    def invalidate(self, *kinds):
+        """
+        Forget memoized collections and entities of the given kinds
+
+        :param kinds: entity kinds to drop, e.g. 'project'
+        """
+        for kind in kinds:
+            self._lists.pop(kind, None)
+            for key in [k for k in self._entities if k[0] == kind]:
+                del self._entities[key]
+
+
+class EntityCache(object):
+    """
+    Cross-request cache of VC3 entities and collections
+
+    Entries expire after a TTL chosen per entity kind, optionally with a
+    different one for the kind's list* collection in list_ttls, and the
+    cache holds at most max_entries, evicting the least recently used entry
+    first.  A TTL of 0 disables caching for that kind.  Stored values are
+    snapshots shared by every reader without copying, so nobody may change
+    a value after putting it or after getting it back; copy the single
+    entity that is about to change instead.
+    """
+
+    def __init__(self, ttls=None, default_ttl=0, max_entries=1024,
+                 list_ttls=None):
+        self.ttls = dict(ttls or {})
+        self.list_ttls = dict(list_ttls or {})
+        self.default_ttl = default_ttl
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()
+        self._generations = {}
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def ttl(self, kind, key=None):
+        """
+        :param key: None for the whole collection, or an entity name
+        :return: lifetime in seconds of entries of kind
+        """
+        if key is None and kind in self.list_ttls:
+            return self.list_ttls[kind]
+        return self.ttls.get(kind, self.default_ttl)
+
+    def generation(self, kind):
+        """
+        Return a token that changes whenever kind is invalidated
+
+        Pass it back to put() so a read that raced with a write does not
+        repopulate the cache with the old state.
+        """
+        with self._lock:
+            return self._generations.get(kind, 0)
+
+    def get(self, kind, key):
+        """
+        Look up a cached value
+
+        :param kind: entity kind, e.g. 'project'
+        :param key: None for the whole collection, or an entity name
+        :return: tuple of (hit, cached value)
+        """
+        hit, value, age = self.lookup(kind, key)
+        return hit, value
+
+    def lookup(self, kind, key):
+        """
+        Look up a cached value and how long ago it was fetched
+
+        :return: tuple of (hit, cached value, age in seconds)
+        """
+        now = time.time()
+        with self._lock:
+            entry = self._entries.pop((kind, key), None)
+            if entry is None or entry[0] < now:
+                self.misses += 1
+                return False, None, None
+            self._entries[(kind, key)] = entry
+            self.hits += 1
+            stored, value = entry[1], entry[2]
+        return True, value, now - stored
+
+    def put(self, kind, key, value, generation=None, ttl=None):
+        """
+        Store value unless kind was invalidated since generation
+
+        :param ttl: lifetime in seconds, defaults to the TTL of kind
+        """
+        if ttl is None:
+            ttl = self.ttl(kind, key)
+        if ttl <= 0:
+            return
+        with self._lock:
+            if (generation is not None and
+                    generation != self._generations.get(kind, 0)):
+                return
+            now = time.time()
+            self._entries.pop((kind, key), None)
+            self._entries[(kind, key)] = (now + ttl, now, value)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def invalidate(self, *kinds):
+        """
+        Drop every cached collection and entity of the given kinds
+        """
+        with self._lock:
+            for kind in kinds:
+                self._generations[kind] = self._generations.get(kind, 0) + 1
+            for key in [k for k in self._entries if k[0] in kinds]:
+                del self._entries[key]
+
+    def stats(self):
+        with self._lock:
+            return {'entries': len(self._entries),
+                    'hits': self.hits,
+                    'misses': self.misses,
+                    'evictions': self.evictions}
+
+
+class SharedCacheClient(object):
+    """
+    VC3 client wrapper that reads through a shared EntityCache
+
+    list* and get* results are served from the cache while fresh, get*
+    falling back to a cached list* collection before asking the
+    infoservice.  list* returns the cached snapshot itself, to be treated
+    as read-only; get* returns a copy of the entity, which the caller may
+    change and store.  Every store*, delete*, add*To*, remove*From* and
+    terminateRequest call invalidates the kinds it touches, so the page a
+    write redirects to is rendered from the new state.
+    """
+
+    def __init__(self, client_api, cache):
+        self._client = client_api
+        self._cache = cache
+
+    def __getattr__(self, attr):
+        method = getattr(self._client, attr)
+        operation, kinds = classify_call(attr)
+        if operation == 'list':
+            return self._cached_list(method, kinds[0])
+        if operation == 'get':
+            return self._cached_get(method, kinds[0])
+        if operation == 'write':
+            return self._invalidating(method, kinds)
+        return method
+
+    def _cached_list(self, method, kind):
+        def list_entities(*args, **kwargs):
+            if args or kwargs:
+                return method(*args, **kwargs)
+            hit, entities, age = self._cache.lookup(kind, None)
+            if hit:
+                record_snapshot_age(age)
+                return entities
+            generation = self._cache.generation(kind)
+            entities = as_collection(method())
+            self._cache.put(kind, None, entities, generation)
+            record_snapshot_age(0)
+            return entities
+        return list_entities
+
+    def _cached_get(self, method, kind):
+        def get_entity(*args, **kwargs):
+            name = single_argument(args, kwargs)
+            if name is None:
+                return method(*args, **kwargs)
+            hit, entity, age = self._cache.lookup(kind, name)
+            if hit:
+                record_snapshot_age(age)
+                return copy.deepcopy(entity)
+            hit, entities, age = self._cache.lookup(kind, None)
+            if hit:
+                entity = entities.get(name)
+                if entity is not None:
+                    record_snapshot_age(age)
+                    return copy.deepcopy(entity)
+            generation = self._cache.generation(kind)
+            entity = method(*args, **kwargs)
+            self._cache.put(kind, name, copy.deepcopy(entity), generation)
+            record_snapshot_age(0)
+            return entity
+        return get_entity
+
+    def _invalidating(self, method, kinds):
+        def write(*args, **kwargs):
+            try:
+                return method(*args, **kwargs)
+            finally:
+                self._cache.invalidate(*kinds)
+        return write
@@ -0,0 +1,89 @@
+import os
+import threading
+
+from ConfigParser import SafeConfigParser
+
+from vc3client import client
+
+from portal import app
+
+
+class VC3ClientPool(object):
+    """
+    Pool of VC3 client instances built from the VC3 client config file
+
+    Every worker thread gets its own VC3ClientAPI, which is built on first
+    use and handed back on every later call, so the config file is parsed
+    once and the client keeps whatever connections it holds.  The config is
+    re-read and the clients rebuilt only when the file's mtime changes.
+    """
+
+    def __init__(self, config_path):
+        self.config_path = config_path
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self._config = None
+        self._mtime = None
+        self._generation = 0
+        self._built = 0
+        self._reuses = {}
+
+    def _current_config(self):
+        """
+        Re-read the config file if its mtime changed since the last load
+
+        :return: tuple of (generation, parsed config)
+        """
+        mtime = os.path.getmtime(self.config_path)
+        with self._lock:
+            if mtime != self._mtime:
+                c = SafeConfigParser()
+                with open(self.config_path) as fh:
+                    c.readfp(fh)
+                self._config = c
+                self._mtime = mtime
+                self._generation += 1
+                app.logger.info("Loaded VC3 client config {0} "
+                                "(generation {1})".format(self.config_path,
+                                                          self._generation))
+            return self._generation, self._config
+
+    def get(self):
+        """
+        Return the VC3 client for the calling thread
+
+        :return: VC3 client instance on success
+        """
+        generation, config = self._current_config()
+        slot = getattr(self._local, 'slot', None)
+        if slot is not None and slot[0] == generation:
+            # only the owning thread touches its own counter
+            self._reuses[slot[1]] += 1
+            return slot[2]
+
+        try:
+            client_api = client.VC3ClientAPI(config)
+        except Exception as e:
+            app.logger.error("Couldn't get vc3 client: {0}".format(e))
+            raise
+
+        with self._lock:
+            self._built += 1
+            client_id = self._built
+            self._reuses[client_id] = 0
+        self._local.slot = (generation, client_id, client_api)
+        app.logger.debug("Built VC3 client #{0} (config generation "
+                         "{1})".format(client_id, generation))
+        return client_api
+
+    def stats(self):
+        """
+        Report how many clients were built and how often each was reused
+
+        :return: dict with the build count and reuse count per client
+        """
+        with self._lock:
+            return {'built': self._built,
+                    'generation': self._generation,
+                    'config_mtime': self._mtime,
+                    'reuses': dict(self._reuses)}
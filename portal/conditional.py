@@ -0,0 +1,101 @@
+import hashlib
+import threading
+import time
+
+from flask import make_response, request, session
+
+
+# Changes on every restart, so a deploy with new templates never matches
+# an ETag handed out by the previous process.
+DEPLOY_TOKEN = repr(time.time())
+
+
+def fingerprint(value):
+    """
+    Reduce entities, dicts and lists to a stable, comparable structure
+
+    :param value: anything the infoservice returns, or built from it
+    :return: nested tuples that repr() the same for equal content
+    """
+    if isinstance(value, dict):
+        return tuple(sorted((k, fingerprint(v)) for k, v in value.items()))
+    if isinstance(value, (list, tuple)):
+        return tuple(fingerprint(v) for v in value)
+    if hasattr(value, '__dict__'):
+        return fingerprint(vars(value))
+    return value
+
+
+def content_etag(*parts):
+    """
+    Compute a strong ETag from the content a response is built from
+
+    :param parts: entities, collections or plain values
+    :return: hex digest usable as an ETag
+    """
+    return hashlib.sha1(repr(fingerprint(parts))).hexdigest()
+
+
+def session_etag(*parts):
+    """
+    Like content_etag, but also varies with the session and the running
+    process, for pages rendered from templates
+    """
+    state = dict((k, v) for k, v in session.items() if k != '_flashes')
+    return content_etag(DEPLOY_TOKEN, state, *parts)
+
+
+class ConditionalStats(object):
+    """
+    Count conditional GETs per endpoint and how many were answered 304
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._counts = {}
+
+    def record(self, endpoint, not_modified):
+        with self._lock:
+            counts = self._counts.setdefault(endpoint, [0, 0])
+            counts[0] += 1
+            if not_modified:
+                counts[1] += 1
+
+    def stats(self):
+        """
+        :return: dict of endpoint to requests, 304s and the 304 hit ratio
+        """
+        with self._lock:
+            return dict((endpoint, {'requests': total,
+                                    'not_modified': hits,
+                                    'hit_ratio': float(hits) / total})
+                        for endpoint, (total, hits) in self._counts.items())
+
+
+conditional_stats = ConditionalStats()
+
+
+def conditional_response(etag, build):
+    """
+    Answer 304 when the client already has etag, otherwise build the
+    response and tag it
+
+    Pending flash messages are rendered into the page, so such responses
+    are neither matched nor tagged.
+
+    :param etag: ETag of the content the response would be built from
+    :param build: callable returning the response, e.g. rendering a template
+    :return: response
+    """
+    if session.get('_flashes'):
+        return build()
+
+    not_modified = request.if_none_match.contains(etag)
+    conditional_stats.record(request.endpoint, not_modified)
+    if not_modified:
+        response = make_response('', 304)
+    else:
+        response = make_response(build())
+    response.set_etag(etag)
+    response.headers['Cache-Control'] = 'private, no-cache'
+    return response
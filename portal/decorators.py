@@ -1,6 +1,6 @@
 from flask import redirect, request, session, url_for, flash
 from functools import wraps
-from portal.utils import get_vc3_client
+from portal.utils import get_vc3_client, vc3_authorizer
 
 
 def authenticated(fn):
@@ -26,12 +26,9 @@ def allocation_validated(f):
     """Mark a route as requiring a validated allocation."""
     @wraps(f)
     def decorated_function(*args, **kwargs):
-        vc3_client = get_vc3_client()
-        allocations = vc3_client.listAllocations()
-        for allocation in allocations:
-            if (session['name'] == allocation.owner and
-                    allocation.state == "ready"):
-                return f(*args, **kwargs)
+        if vc3_authorizer.has_ready_allocation(get_vc3_client(),
+                                               session['name']):
+            return f(*args, **kwargs)
         flash('You must have a validated allocation to create a project.', 'warning')
         return redirect(url_for('list_allocations', next=request.url))
     return decorated_function
@@ -41,12 +38,8 @@ def project_exists(f):
     """Mark a route as requiring being within any validated project."""
     @wraps(f)
     def decorated_function(*args, **kwargs):
-        vc3_client = get_vc3_client()
-        projects = vc3_client.listProjects()
-        for project in projects:
-            if (session['name'] == project.owner or
-                    session['name'] in project.members):
-                return f(*args, **kwargs)
+        if vc3_authorizer.in_any_project(get_vc3_client(), session['name']):
+            return f(*args, **kwargs)
         flash('You must be within a project in order to proceed.', 'warning')
         return redirect(url_for('list_projects', next=request.url))
     return decorated_function
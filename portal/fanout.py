@@ -0,0 +1,106 @@
+import threading
+import time
+
+from multiprocessing.pool import ThreadPool
+
+from portal.client_cache import pop_snapshot_age, record_snapshot_age
+
+
+class FanOut(object):
+    """
+    Thread pool issuing independent VC3 client calls concurrently
+
+    Worker threads never touch the Flask request context: each call runs
+    on the client that client_factory returns in the worker thread, so
+    every worker uses its own pooled VC3 client.  The age of the cached
+    data a call was answered from is handed back with its result and
+    recorded in the calling request.
+
+    When the calls of a run do not fit in the threads left idle by the
+    runs in flight, the run is issued serially in the calling thread
+    instead of queueing behind them, so a busy portal degrades to the
+    plain sequential fetches rather than waiting on the pool.
+    """
+
+    def __init__(self, client_factory, threads=8, timeout=30):
+        self.client_factory = client_factory
+        self.threads = threads
+        self.timeout = timeout
+        self._lock = threading.Lock()
+        self._pool = None
+        self._busy = 0
+        self.concurrent_runs = 0
+        self.serial_runs = 0
+
+    def _get_pool(self):
+        # created lazily so a forking server does not inherit the threads
+        with self._lock:
+            if self._pool is None:
+                self._pool = ThreadPool(processes=self.threads)
+            return self._pool
+
+    def _call(self, call):
+        attr, args, kwargs = call
+        try:
+            # drop what an earlier call that failed left behind
+            pop_snapshot_age()
+            result = getattr(self.client_factory(), attr)(*args, **kwargs)
+            return result, pop_snapshot_age()
+        finally:
+            with self._lock:
+                self._busy -= 1
+
+    def run(self, calls, timeout=None):
+        """
+        Issue calls concurrently and wait for all of them
+
+        :param calls: list of (method name, args, kwargs) tuples
+        :param timeout: seconds each call may take, counted from when it
+            was issued; defaults to the pool's timeout
+        :return: list of results, in the order of calls
+        :raises: the first failing call's exception, or
+            multiprocessing.TimeoutError if a call did not finish in time
+        """
+        if not calls:
+            return []
+        if timeout is None:
+            timeout = self.timeout
+        with self._lock:
+            saturated = self._busy + len(calls) > self.threads
+            if saturated:
+                self.serial_runs += 1
+            else:
+                self._busy += len(calls)
+                self.concurrent_runs += 1
+        if saturated:
+            return [getattr(self.client_factory(), attr)(*args, **kwargs)
+                    for attr, args, kwargs in calls]
+        pool = self._get_pool()
+        deadline = time.time() + timeout
+        pending = [pool.apply_async(self._call, (call,)) for call in calls]
+        results = []
+        for result in pending:
+            value, age = result.get(max(0, deadline - time.time()))
+            if age is not None:
+                record_snapshot_age(age)
+            results.append(value)
+        return results
+
+    def stats(self):
+        with self._lock:
+            return {'threads': self.threads,
+                    'busy': self._busy,
+                    'concurrent_runs': self.concurrent_runs,
+                    'serial_runs': self.serial_runs}
+
+
+def normalize_call(call):
+    """
+    Accept 'listUsers' or ('getProject', {'projectname': name}) forms
+
+    :return: (method name, args, kwargs) tuple
+    """
+    if isinstance(call, basestring):
+        return call, (), {}
+    attr, kwargs = call
+    return attr, (), kwargs
@@ -0,0 +1,176 @@
+import hashlib
+import json
+import os
+import warnings
+
+from flask import url_for
+from flask_frozen import MissingURLGeneratorWarning
+from jinja2 import meta
+
+from portal import app, pages, articles, freezer
+from portal.assets import DIST, MANIFEST as ASSETS_MANIFEST
+from portal.bundles import BUNDLE_DIR, MANIFEST as BUNDLES_MANIFEST
+from portal.views import LATEST_ARTICLES
+
+
+# Public pages without arguments and the template each one renders
+PUBLIC_PAGES = {'home': 'home.html',
+                'team': 'team.html',
+                'community': 'community.html',
+                'documentations': 'documentations.html',
+                'blog': 'blog.html'}
+
+# What every frozen URL was built from, kept in the build directory
+MANIFEST = '.freeze-manifest.json'
+
+# URLs the freezer renders in the current build
+_stale_urls = []
+
+
+@freezer.register_generator
+def stale_public_urls():
+    return list(_stale_urls)
+
+
+def template_sources(name, seen=None):
+    """
+    Sources of a template and of every template it extends, includes or
+    imports
+
+    :param name: template name, e.g. 'blog.html'
+    :return: dict of template name to source
+    """
+    if seen is None:
+        seen = {}
+    if name in seen:
+        return seen
+    source = app.jinja_env.loader.get_source(app.jinja_env, name)[0]
+    seen[name] = source
+    for referenced in meta.find_referenced_templates(
+            app.jinja_env.parse(source)):
+        if referenced is not None:
+            template_sources(referenced, seen)
+    return seen
+
+
+def public_pages():
+    """
+    Every public page to export
+
+    :return: list of (endpoint, values, template, pages shown) tuples
+    """
+    public = []
+    for endpoint, template in sorted(PUBLIC_PAGES.items()):
+        shown = []
+        if endpoint == 'blog':
+            shown = articles.latest(LATEST_ARTICLES)
+        public.append((endpoint, {}, template, shown))
+    for page in pages:
+        public.append(('page', {'path': page.path}, 'blog_page.html', [page]))
+    for tag in articles.tags():
+        public.append(('tag', {'tag': tag}, 'blog_tag.html',
+                       articles.tagged(tag)))
+    return public
+
+
+def asset_manifests():
+    """
+    The asset and bundle manifests pages link static files through, as
+    far as they were built
+
+    :return: their contents, concatenated
+    """
+    contents = []
+    for path in ((DIST, ASSETS_MANIFEST), (BUNDLE_DIR, BUNDLES_MANIFEST)):
+        filename = os.path.join(app.static_folder, *path)
+        if os.path.isfile(filename):
+            with open(filename, 'rb') as fh:
+                contents.append(fh.read())
+        else:
+            contents.append('')
+    return '\0'.join(contents)
+
+
+def build_digest(template, shown, closures, assets):
+    """
+    Digest of everything a page is rendered from: its templates, the
+    pages it shows and the static files it links
+
+    :param closures: dict of template name to template_sources() result,
+        filled in as templates are first seen
+    :param assets: asset_manifests(), so pages are rendered again once
+        hashed file names or bundles change
+    """
+    if template not in closures:
+        closures[template] = template_sources(template)
+    digest = hashlib.sha1()
+    for name, source in sorted(closures[template].items()):
+        digest.update(name.encode('utf-8'))
+        digest.update(source.encode('utf-8'))
+    for page in shown:
+        digest.update(repr((page.path, page.meta, page.body)))
+    digest.update(assets)
+    return digest.hexdigest()
+
+
+def remove_frozen(url):
+    """
+    Delete the file frozen for url and any directories left empty
+    """
+    filename = os.path.join(freezer.root,
+                            *freezer.urlpath_to_filepath(url).split('/'))
+    if os.path.isfile(filename):
+        os.remove(filename)
+        parent = os.path.dirname(filename)
+        if not os.listdir(parent):
+            os.removedirs(parent)
+
+
+def freeze_public_pages(force=False):
+    """
+    Export the public pages into FREEZER_DESTINATION for a web server to
+    serve directly
+
+    Only pages whose templates or Markdown sources changed since the last
+    build are rendered again, and pages that no longer exist are removed.
+
+    :param force: render every page regardless of the previous build
+    :return: tuple of (rendered, unchanged, removed) URL counts
+    """
+    app.config['FREEZER_REMOVE_EXTRA_FILES'] = False
+    manifest_path = os.path.join(freezer.root, MANIFEST)
+    previous = {}
+    if os.path.isfile(manifest_path):
+        with open(manifest_path) as fh:
+            previous = json.load(fh)
+
+    current = {}
+    closures = {}
+    assets = asset_manifests()
+    del _stale_urls[:]
+    with app.test_request_context():
+        for endpoint, values, template, shown in public_pages():
+            url = url_for(endpoint, **values)
+            current[url] = build_digest(template, shown, closures, assets)
+            filename = os.path.join(
+                freezer.root, *freezer.urlpath_to_filepath(url).split('/'))
+            if (force or previous.get(url) != current[url] or
+                    not os.path.isfile(filename)):
+                _stale_urls.append(url)
+
+    removed = [gone for gone in previous if gone not in current]
+    for url in removed:
+        remove_frozen(url)
+
+    with warnings.catch_warnings():
+        # every route that is not public is left out on purpose
+        warnings.simplefilter('ignore', MissingURLGeneratorWarning)
+        freezer.freeze()
+
+    with open(manifest_path, 'w') as fh:
+        json.dump(current, fh, indent=2, sort_keys=True)
+    app.logger.info("Froze public pages into {0}: {1} rendered, {2} "
+                    "unchanged, {3} removed".format(
+                        freezer.root, len(_stale_urls),
+                        len(current) - len(_stale_urls), len(removed)))
+    return len(_stale_urls), len(current) - len(_stale_urls), len(removed)
@@ -0,0 +1,18 @@
+import posixpath
+
+from flask_frozen import Freezer
+
+
+class DirectoryIndexFreezer(Freezer):
+    """
+    Freezer writing extension-less URLs such as /team or /blog as
+    team/index.html and blog/index.html
+
+    /blog and the articles under /blog/<path>/ can then live side by side,
+    and a web server serves every page with try_files $uri $uri/index.html.
+    """
+
+    def urlpath_to_filepath(self, path):
+        if not path.endswith('/') and '.' not in posixpath.basename(path):
+            path += '/'
+        return super(DirectoryIndexFreezer, self).urlpath_to_filepath(path)
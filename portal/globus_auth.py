@@ -0,0 +1,279 @@
+import threading
+import time
+
+from contextlib import contextmanager
+
+import globus_sdk
+import requests
+
+from jose import jwt
+
+from portal import app
+
+
+class PortalAuthClient(object):
+    """
+    The portal's Globus Auth client and its client-credential tokens
+
+    Every worker thread gets one ConfidentialAppAuthClient, built on first
+    use, whose HTTP session is reused for every login, logout and callback
+    the thread serves.  Clients are not shared between threads because
+    oauth2_start_flow() keeps the login flow on the client.
+
+    Client-credential tokens are cached per set of scopes and fetched again
+    only once the first of them is within refresh_margin seconds of its
+    expires_at.  Concurrent requests for the same scopes wait for a single
+    fetch instead of each making their own.
+    """
+
+    def __init__(self, client_id, client_secret, refresh_margin=60):
+        self.client_id = client_id
+        self.client_secret = client_secret
+        self.refresh_margin = refresh_margin
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self._tokens = {}
+        self._fetch_locks = {}
+        self.clients_built = 0
+        self.token_hits = 0
+        self.token_fetches = 0
+        self.token_failures = 0
+
+    def client(self):
+        """
+        :return: the ConfidentialAppAuthClient of the calling thread
+        """
+        client = getattr(self._local, 'client', None)
+        if client is None:
+            client = globus_sdk.ConfidentialAppAuthClient(self.client_id,
+                                                          self.client_secret)
+            self._local.client = client
+            with self._lock:
+                self.clients_built += 1
+        return client
+
+    def _fresh(self, key):
+        entry = self._tokens.get(key)
+        if entry is not None and entry[0] - self.refresh_margin > time.time():
+            return entry[1]
+        return None
+
+    def tokens(self, scopes):
+        """
+        Client-credential access tokens for a set of scopes
+
+        :param scopes: iterable of scope strings
+        :return: dict of resource server to dict with the 'token', its
+            'scope' and 'expires_at' in epoch seconds
+        """
+        key = frozenset(scopes)
+        with self._lock:
+            tokens = self._fresh(key)
+            if tokens is not None:
+                self.token_hits += 1
+                return tokens
+            fetch_lock = self._fetch_locks.setdefault(key, threading.Lock())
+
+        with fetch_lock:
+            # another thread may have fetched them while this one waited
+            with self._lock:
+                tokens = self._fresh(key)
+                if tokens is not None:
+                    self.token_hits += 1
+                    return tokens
+            try:
+                response = self.client().oauth2_client_credentials_tokens(
+                    requested_scopes=' '.join(sorted(key)))
+            except Exception as e:
+                with self._lock:
+                    self.token_failures += 1
+                app.logger.error("Couldn't get portal tokens for {0}: "
+                                 "{1}".format(' '.join(sorted(key)), e))
+                raise
+            tokens = {}
+            for resource_server, info in response.by_resource_server.items():
+                tokens[resource_server] = {
+                    'token': info['access_token'],
+                    'scope': info['scope'],
+                    'expires_at': info['expires_at_seconds']
+                }
+            expires_at = min([t['expires_at'] for t in tokens.values()] or
+                             [time.time()])
+            with self._lock:
+                self._tokens[key] = (expires_at, tokens)
+                self.token_fetches += 1
+            return tokens
+
+    def stats(self):
+        with self._lock:
+            return {'clients_built': self.clients_built,
+                    'scope_sets': len(self._tokens),
+                    'token_hits': self.token_hits,
+                    'token_fetches': self.token_fetches,
+                    'token_failures': self.token_failures}
+
+
+class OIDCKeyCache(object):
+    """
+    Globus Auth's OpenID configuration and signing keys, for verifying ID
+    tokens without fetching either on every login
+
+    Both are kept for ttl seconds.  The keys are fetched again early only
+    when a token names a key id the cached set lacks, i.e. after Globus
+    rotated its keys, and at most once every min_refetch seconds so tokens
+    with made-up key ids cannot turn every login into a fetch.
+    """
+
+    DISCOVERY_PATH = '/.well-known/openid-configuration'
+
+    def __init__(self, ttl=3600, min_refetch=60):
+        self.ttl = ttl
+        self.min_refetch = min_refetch
+        self._lock = threading.Lock()
+        self._fetch_lock = threading.Lock()
+        self._session = requests.Session()
+        self._configuration = None
+        self._configuration_expires = 0
+        self._jwks = None
+        self._kids = set()
+        self._jwks_fetched = 0
+        self.configuration_fetches = 0
+        self.jwks_fetches = 0
+        self.unknown_kid_fetches = 0
+        self.hits = 0
+
+    def _jwks_usable(self, kid, now):
+        if self._jwks is None or self._jwks_fetched + self.ttl < now:
+            return False
+        return (kid is None or kid in self._kids or
+                self._jwks_fetched + self.min_refetch > now)
+
+    def configuration(self, auth_client):
+        """
+        :param auth_client: Globus AuthClient
+        :return: dict of the OpenID configuration of Globus Auth
+        """
+        with self._fetch_lock:
+            if self._configuration_expires < time.time():
+                self._configuration = auth_client.get(
+                    self.DISCOVERY_PATH).data
+                self._configuration_expires = time.time() + self.ttl
+                with self._lock:
+                    self.configuration_fetches += 1
+            return self._configuration
+
+    def jwks(self, auth_client, kid=None):
+        """
+        :param auth_client: Globus AuthClient
+        :param kid: key id the token to verify was signed with
+        :return: the JSON Web Key Set of Globus Auth
+        """
+        with self._lock:
+            if self._jwks_usable(kid, time.time()):
+                self.hits += 1
+                return self._jwks
+        configuration = self.configuration(auth_client)
+        with self._fetch_lock:
+            # another login may have fetched the keys in the meantime
+            now = time.time()
+            if self._jwks_usable(kid, now):
+                return self._jwks
+            unknown_kid = (self._jwks is not None and
+                           self._jwks_fetched + self.ttl >= now)
+            # use the auth client's decision on ssl_verify=yes/no
+            jwks = self._session.get(configuration['jwks_uri'],
+                                     verify=auth_client._verify).json()
+            with self._lock:
+                self._jwks = jwks
+                self._kids = set(key.get('kid') for key in jwks['keys'])
+                self._jwks_fetched = time.time()
+                self.jwks_fetches += 1
+                if unknown_kid:
+                    self.unknown_kid_fetches += 1
+            return jwks
+
+    def decode_id_token(self, tokens, auth_client):
+        """
+        Verify and parse the ID token of a token response, like
+        OAuthTokenResponse.decode_id_token but with the cached keys
+
+        :param tokens: OAuthTokenResponse of the authorization code exchange
+        :param auth_client: the Globus AuthClient that made the exchange
+        :return: dict of the ID token's claims
+        """
+        id_token = tokens['id_token']
+        kid = jwt.get_unverified_header(id_token).get('kid')
+        return jwt.decode(id_token, self.jwks(auth_client, kid),
+                          access_token=tokens['access_token'],
+                          audience=auth_client.client_id)
+
+    def stats(self):
+        with self._lock:
+            return {'configuration_fetches': self.configuration_fetches,
+                    'jwks_fetches': self.jwks_fetches,
+                    'unknown_kid_fetches': self.unknown_kid_fetches,
+                    'hits': self.hits}
+
+
+class PhaseTimings(object):
+    """
+    How long each phase of a multi-step operation such as a login takes,
+    summed over every run
+    """
+
+    def __init__(self, name):
+        self.name = name
+        self._lock = threading.Lock()
+        self._phases = {}
+        self.runs = 0
+
+    def start(self, label=''):
+        """
+        :param label: what this run is about, for the log
+        :return: PhaseTimer of a new run
+        """
+        return PhaseTimer(self, label)
+
+    def record(self, label, phases):
+        with self._lock:
+            self.runs += 1
+            for phase, elapsed in phases:
+                total, count, longest = self._phases.get(phase, (0.0, 0, 0.0))
+                self._phases[phase] = (total + elapsed, count + 1,
+                                       max(longest, elapsed))
+        app.logger.info("{0} {1}: {2}".format(
+            self.name, label, ', '.join('{0} {1:.3f}s'.format(phase, elapsed)
+                                        for phase, elapsed in phases)))
+
+    def stats(self):
+        """
+        :return: dict with the number of runs and, per phase, the mean and
+            longest time in seconds
+        """
+        with self._lock:
+            phases = dict((phase, {'mean': total / count, 'max': longest})
+                          for phase, (total, count, longest)
+                          in self._phases.items())
+            return {'runs': self.runs, 'phases': phases}
+
+
+class PhaseTimer(object):
+    """
+    Times the phases of one run of a PhaseTimings operation
+    """
+
+    def __init__(self, timings, label):
+        self.timings = timings
+        self.label = label
+        self.phases = []
+
+    @contextmanager
+    def phase(self, name):
+        start = time.time()
+        try:
+            yield
+        finally:
+            self.phases.append((name, time.time() - start))
+
+    def finish(self):
+        self.timings.record(self.label, self.phases)
@@ -0,0 +1,101 @@
+import threading
+import time
+
+from collections import OrderedDict
+from functools import wraps
+
+from flask import Response, make_response, request, session
+
+
+class PageCache(object):
+    """
+    Cache of whole rendered responses for anonymous visitors
+
+    Entries are keyed by host, path, query string and a content version
+    made of the cache's own version, bumped by invalidate(), and the
+    entity cache generations of the VC3 entity kinds a page shows, so
+    portal writes to those kinds retire the cached pages at once.
+    Anything served to a visitor with a session (logged in, flashed
+    messages, a pending login redirect) is neither served from nor stored
+    in the cache.
+    """
+
+    def __init__(self, entity_cache, ttl=300, max_entries=256):
+        self.entity_cache = entity_cache
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()
+        self._version = 0
+        self.hits = 0
+        self.misses = 0
+        self.bypassed = 0
+
+    def invalidate(self):
+        """
+        Drop every cached page, e.g. after deploying new templates
+        """
+        with self._lock:
+            self._version += 1
+            self._entries.clear()
+
+    def _key(self, kinds):
+        generations = tuple(self.entity_cache.generation(kind)
+                            for kind in kinds)
+        return (request.host, request.path,
+                tuple(sorted(request.args.items(multi=True))),
+                self._version, generations)
+
+    def _get(self, key):
+        with self._lock:
+            entry = self._entries.pop(key, None)
+            if entry is None or entry[0] < time.time():
+                self.misses += 1
+                return None
+            self._entries[key] = entry
+            self.hits += 1
+            return entry[1]
+
+    def _put(self, key, response):
+        if (response.status_code != 200 or response.direct_passthrough or
+                'Set-Cookie' in response.headers):
+            return
+        headers = [(k, v) for k, v in response.headers.items()
+                   if k.lower() != 'content-length']
+        stored = (response.get_data(), response.status_code, headers)
+        with self._lock:
+            self._entries[key] = (time.time() + self.ttl, stored)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def public(self, *kinds):
+        """
+        Cache the decorated view's responses for anonymous GETs
+
+        :param kinds: VC3 entity kinds the page shows, e.g. 'resource'
+        """
+        def decorator(fn):
+            @wraps(fn)
+            def decorated_function(*args, **kwargs):
+                if request.method != 'GET' or session:
+                    with self._lock:
+                        self.bypassed += 1
+                    return fn(*args, **kwargs)
+                key = self._key(kinds)
+                stored = self._get(key)
+                if stored is not None:
+                    data, status, headers = stored
+                    return Response(data, status, headers)
+                response = make_response(fn(*args, **kwargs))
+                if not session:
+                    self._put(key, response)
+                return response
+            return decorated_function
+        return decorator
+
+    def stats(self):
+        with self._lock:
+            return {'entries': len(self._entries),
+                    'hits': self.hits,
+                    'misses': self.misses,
+                    'bypassed': self.bypassed}
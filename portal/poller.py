@@ -0,0 +1,98 @@
+import threading
+
+from flask import g
+
+from portal import app
+from portal.client_cache import as_collection
+
+
+class SnapshotPoller(object):
+    """
+    Background refresher of the busiest VC3 collections
+
+    A daemon thread lists each collection every interval seconds and
+    stores it in the shared entity cache for max_age seconds.  Handlers
+    keep reading the cached snapshot while a refresh is in flight and only
+    fetch synchronously once a snapshot is older than max_age, or after a
+    write invalidated it.
+    """
+
+    # entity kind -> VC3 client method listing it
+    COLLECTIONS = {'request': 'listRequests',
+                   'nodeset': 'listNodesets',
+                   'allocation': 'listAllocations',
+                   'project': 'listProjects'}
+
+    def __init__(self, client_factory, cache, interval=5, max_age=30):
+        self.client_factory = client_factory
+        self.cache = cache
+        self.interval = interval
+        self.max_age = max_age
+        self._thread = None
+        self._stop = threading.Event()
+        self.refreshes = 0
+        self.failures = 0
+
+    def start(self):
+        """
+        Start the refresher thread, once
+        """
+        if self._thread is not None:
+            return
+        self._thread = threading.Thread(target=self._run,
+                                        name='vc3-snapshot-poller')
+        self._thread.daemon = True
+        self._thread.start()
+        app.logger.info("Started VC3 snapshot poller (every {0}s, max age "
+                        "{1}s)".format(self.interval, self.max_age))
+
+    def stop(self):
+        self._stop.set()
+
+    def _run(self):
+        while not self._stop.is_set():
+            try:
+                self.refresh()
+            except Exception as e:
+                self.failures += 1
+                app.logger.error("Snapshot poller failed: {0}".format(e))
+            self._stop.wait(self.interval)
+
+    def refresh(self):
+        """
+        List every polled collection once and store it in the cache
+
+        A collection that fails to load keeps serving its last snapshot
+        until that reaches max_age.
+        """
+        vc3_client = self.client_factory()
+        for kind, method in sorted(self.COLLECTIONS.items()):
+            generation = self.cache.generation(kind)
+            try:
+                entities = as_collection(getattr(vc3_client, method)())
+            except Exception as e:
+                self.failures += 1
+                app.logger.error("Couldn't refresh {0} snapshot: "
+                                 "{1}".format(kind, e))
+                continue
+            self.cache.put(kind, None, entities, generation, self.max_age)
+        self.refreshes += 1
+
+    def stats(self):
+        return {'running': self._thread is not None and
+                self._thread.is_alive(),
+                'interval': self.interval,
+                'max_age': self.max_age,
+                'refreshes': self.refreshes,
+                'failures': self.failures}
+
+
+@app.after_request
+def add_snapshot_age(response):
+    """
+    Tell monitoring how stale the cached data behind a response was
+    """
+    age = getattr(g, 'vc3_snapshot_age', None)
+    if age is not None:
+        response.headers['X-VC3-Snapshot-Age'] = '{0:.1f}'.format(age)
+    return response
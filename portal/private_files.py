@@ -0,0 +1,73 @@
+import errno
+import os
+import stat
+
+
+def check_private(path, is_kind=stat.S_ISREG, mask=0o077):
+    """
+    Make sure a path belongs to the portal's user and nobody else may use
+    it, so other local users can neither read nor plant what it holds
+
+    :param path: file or directory to check; symlinks are refused
+    :param is_kind: stat.S_ISREG or stat.S_ISDIR
+    :param mask: permission bits nobody but the owner may have
+    :raises: OSError with errno EPERM if the path is not private
+    """
+    check_private_stat(path, os.lstat(path), is_kind, mask)
+
+
+def check_private_stat(path, st, is_kind=stat.S_ISREG, mask=0o077):
+    if not is_kind(st.st_mode):
+        raise OSError(errno.EPERM, "Wrong file type, or a symlink", path)
+    if st.st_uid != os.getuid():
+        raise OSError(errno.EPERM, "Not owned by the portal's user", path)
+    if st.st_mode & mask:
+        raise OSError(errno.EPERM, "Open to other users (mode {0:o})".format(
+            stat.S_IMODE(st.st_mode)), path)
+
+
+def private_directory(path, mask=0o077):
+    """
+    Create a directory only the portal's user may use, or check that the
+    existing one is
+
+    :param mask: permission bits nobody but the owner may have, e.g. 0o022
+        for a directory others may list but not write to
+    :return: path
+    :raises: OSError if the directory cannot be created or is not private
+    """
+    try:
+        os.makedirs(path, 0o700)
+    except OSError as e:
+        if e.errno != errno.EEXIST:
+            raise
+    check_private(path, stat.S_ISDIR, mask)
+    return path
+
+
+def open_private(path, flags):
+    """
+    Open a file only the portal's user may use, creating it with mode 0600
+    unless it exists
+
+    A new file is created exclusively, so nothing planted in between is
+    followed; an existing one must be a regular file owned by the portal's
+    user without group or other permissions.
+
+    :param flags: os.open flags besides O_CREAT and O_EXCL, e.g. O_RDWR
+    :return: file descriptor
+    :raises: OSError if the file cannot be opened or is not private
+    """
+    flags |= getattr(os, 'O_NOFOLLOW', 0)
+    try:
+        return os.open(path, flags | os.O_CREAT | os.O_EXCL, 0o600)
+    except OSError as e:
+        if e.errno != errno.EEXIST:
+            raise
+    fd = os.open(path, flags)
+    try:
+        check_private_stat(path, os.fstat(fd))
+    except OSError:
+        os.close(fd)
+        raise
+    return fd
@@ -0,0 +1,137 @@
+import base64
+import calendar
+import datetime
+import hashlib
+import re
+import struct
+import threading
+
+from collections import OrderedDict
+
+from cryptography import x509
+from cryptography.hazmat.backends import default_backend
+
+from portal import app
+
+
+# ssh-rsa-cert-v01@openssh.com AAAA... comment
+SSH_CERT_LINE = re.compile(r'(\S+-cert-v01@openssh\.com)\s+([A-Za-z0-9+/=]+)')
+
+# key type specific public key fields between the nonce and the serial
+SSH_CERT_KEY_FIELDS = {'ssh-rsa': 2, 'ssh-dss': 4, 'ssh-ed25519': 1,
+                       'ecdsa-sha2-nistp256': 2, 'ecdsa-sha2-nistp384': 2,
+                       'ecdsa-sha2-nistp521': 2}
+
+
+def x509_not_valid_after(proxystr):
+    """
+    :param proxystr: PEM encoded x509 proxy
+    :return: naive UTC datetime after which the proxy is no longer valid
+    """
+    cert = x509.load_pem_x509_certificate(proxystr, default_backend())
+    return cert.not_valid_after
+
+
+def ssh_cert_not_valid_after(proxystr):
+    """
+    Read the 'valid before' time of the OpenSSH certificate an SSH proxy
+    (e.g. NERSC sshproxy) comes with
+
+    :param proxystr: private key followed by its certificate line
+    :return: naive UTC datetime after which the certificate is no longer
+        valid, or None if it never expires
+    """
+    match = SSH_CERT_LINE.search(proxystr)
+    if match is None:
+        raise ValueError('no OpenSSH certificate found in proxy')
+    blob = base64.b64decode(match.group(2))
+    offset = [0]
+
+    def read(size):
+        data = blob[offset[0]:offset[0] + size]
+        if len(data) != size:
+            raise ValueError('truncated OpenSSH certificate')
+        offset[0] += size
+        return data
+
+    def read_string():
+        return read(struct.unpack('>I', read(4))[0])
+
+    key_type = read_string()
+    base_type = key_type.replace('-cert-v01@openssh.com', '')
+    if base_type not in SSH_CERT_KEY_FIELDS:
+        raise ValueError('unsupported certificate type {0}'.format(key_type))
+    read_string()  # nonce
+    for _ in range(SSH_CERT_KEY_FIELDS[base_type]):
+        read_string()
+    read(8 + 4)  # serial, type
+    read_string()  # key id
+    read_string()  # valid principals
+    read(8)  # valid after
+    valid_before = struct.unpack('>Q', read(8))[0]
+    if valid_before == 0xffffffffffffffff:
+        return None
+    return datetime.datetime.utcfromtimestamp(valid_before)
+
+
+PARSERS = {'gsissh': x509_not_valid_after,
+           'sshproxy': ssh_cert_not_valid_after}
+
+
+class ProxyExpirationCache(object):
+    """
+    Expiration times of allocation proxies, keyed by a digest of the token
+
+    Tokens are only decoded and parsed the first time they are seen; an
+    unreadable token is remembered as such so it is not parsed again.
+    """
+
+    def __init__(self, max_entries=256):
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def not_valid_after(self, privtoken, method):
+        """
+        :param privtoken: base64 encoded proxy as stored in the allocation
+        :param method: access method of the resource, 'gsissh' or 'sshproxy'
+        :return: tuple of (readable, naive UTC expiration datetime or None)
+        """
+        key = hashlib.sha256('{0}\0{1}'.format(method, privtoken)).digest()
+        with self._lock:
+            entry = self._entries.pop(key, None)
+            if entry is not None:
+                self._entries[key] = entry
+                self.hits += 1
+                return entry
+            self.misses += 1
+
+        try:
+            entry = True, PARSERS[method](base64.b64decode(privtoken))
+        except Exception as e:
+            app.logger.error("Error while reading proxy {0}".format(e))
+            entry = False, None
+
+        with self._lock:
+            self._entries[key] = entry
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+        return entry
+
+    def stats(self):
+        with self._lock:
+            return {'entries': len(self._entries),
+                    'hits': self.hits,
+                    'misses': self.misses}
+
+
+def epoch_seconds(utc_datetime):
+    """
+    :param utc_datetime: naive UTC datetime, or None
+    :return: seconds since the epoch, or None
+    """
+    if utc_datetime is None:
+        return None
+    return calendar.timegm(utc_datetime.utctimetuple())
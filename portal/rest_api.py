@@ -1,10 +1,146 @@
 
 import flask
 import base64
-from portal.utils import get_vc3_client
+import threading
+import time
+from portal.utils import (get_vc3_client, get_shared_vc3_client,
+                          vc3_client_pool, vc3_entity_cache, snapshot_poller,
+                          vc3_authorizer, builder_catalog, proxy_expirations,
+                          get_proxy_expiration, page_cache, portal_auth,
+                          oidc_keys, login_timings, token_revoker,
+                          user_directory, vc3_fanout)
 
-from portal import app
+from portal import app, session_metrics
 from portal.decorators import authenticated
+from portal.conditional import (conditional_response, content_etag,
+                                conditional_stats)
+from portal.proxy_expiration import epoch_seconds
+from portal.views import whitelist
+
+# Fields whose change is pushed to /rest/stream subscribers
+STREAM_FIELDS = {'virtual_cluster': ('state', 'action', 'statereason',
+                                     'statusinfo', 'headnode_state',
+                                     'headnode_app_host'),
+                 'allocation': ('state', 'action', 'statereason', 'pubtoken',
+                                'expiration')}
+
+
+class StreamSlots(object):
+    """
+    Limit on the /rest/stream responses one worker process serves at once
+
+    Every open stream holds a server thread for up to VC3_STREAM_LIFETIME
+    seconds, so without a limit the streams of a few open pages would take
+    every thread and leave none for ordinary requests.
+    """
+
+    def __init__(self, limit):
+        self.limit = limit
+        self._lock = threading.Lock()
+        self.open = 0
+        self.served = 0
+        self.refused = 0
+
+    def acquire(self):
+        """
+        :return: True if a stream may start, and must be released later
+        """
+        with self._lock:
+            if self.open >= self.limit:
+                self.refused += 1
+                return False
+            self.open += 1
+            self.served += 1
+            return True
+
+    def release(self):
+        with self._lock:
+            self.open -= 1
+
+    def stats(self):
+        with self._lock:
+            return {'limit': self.limit,
+                    'open': self.open,
+                    'served': self.served,
+                    'refused': self.refused}
+
+
+stream_slots = StreamSlots(app.config.get('VC3_STREAM_MAX', 8))
+
+
+def sanitize_virtual_cluster(vc, nodesets):
+    """
+    Build the public status of a virtual cluster
+
+    :param vc: virtual cluster (request) entity
+    :param nodesets: EntityCollection of nodesets, to find the headnode
+    :return: dict safe to return as json
+    """
+    sanitized_obj = {'name': vc.name,
+                     'state': vc.state,
+                     'cluster': vc.cluster,
+                     'statusraw': vc.statusraw,
+                     'statusinfo': vc.statusinfo,
+                     'displayname': vc.displayname,
+                     'description': vc.description,
+                     'statereason': vc.state_reason,
+                     'action': vc.action,
+                     'headnode': vc.headnode}
+    if vc.statusinfo is not None:
+        statusinfo = vc.statusinfo[vc.statusinfo.keys()[0]]
+        for field in ('error', 'idle', 'node_number', 'requested', 'running'):
+            sanitized_obj['statusinfo_' + field] = statusinfo[field]
+    nodeset = nodesets.get(vc.headnode)
+    if nodeset is not None:
+        sanitized_obj['headnode_app_host'] = nodeset.app_host
+        sanitized_obj['headnode_app_type'] = nodeset.app_type
+        sanitized_obj['headnode_state'] = nodeset.state
+        sanitized_obj['headnode_state_reason'] = nodeset.state_reason
+    return sanitized_obj
+
+
+def sanitize_allocation(x, resources):
+    """
+    Build the public status of an allocation
+
+    Allocations on gsissh and sshproxy resources carry the proxy expiration
+    in seconds since the epoch, so pages can count down without reloading.
+
+    :param x: allocation entity
+    :param resources: EntityCollection of resources
+    :return: dict safe to return as json
+    """
+    sanitized_obj = {'name': x.name,
+                     'state': x.state,
+                     'action': x.action,
+                     'owner': x.owner,
+                     'displayname': x.displayname,
+                     'description': x.description,
+                     'statereason': x.state_reason,
+                     'pubtoken': x.pubtoken}
+    if x.pubtoken:
+        sanitized_obj['pubtoken'] = base64.b64decode(
+            x.pubtoken).rstrip('\n')
+    resource = resources.get(x.resource)
+    if resource is not None and resource.accessmethod in ('gsissh',
+                                                          'sshproxy'):
+        sanitized_obj['expiration'] = epoch_seconds(get_proxy_expiration(
+            x.privtoken, resource.accessmethod))
+    return sanitized_obj
+
+
+def requested_names():
+    """
+    Names asked for in the comma separated 'names' query argument
+
+    :return: list of distinct names, in request order
+    """
+    names = []
+    for name in flask.request.args.get('names', '').split(','):
+        name = name.strip()
+        if name and name not in names:
+            names.append(name)
+    return names
 
 
 @app.route('/rest/virtual_cluster/<name>', methods=['GET'])
@@ -18,40 +154,33 @@ def virtual_cluster(name):
     """
     result = {}
     vc3_client = get_vc3_client()
-    virtual_clusters = vc3_client.listRequests()
+    vc = vc3_client.listRequests().get(name)
+    if vc is None:
+        return flask.jsonify(result), 404
+
+    sanitized_obj = sanitize_virtual_cluster(vc, vc3_client.listNodesets())
+    return conditional_response(content_etag(sanitized_obj),
+                                lambda: flask.jsonify(sanitized_obj))
+
+
+@app.route('/rest/virtual_clusters', methods=['GET'])
+@authenticated
+def virtual_clusters():
+    """
+    Get information for every cluster named in ?names=a,b,c
+    from a single snapshot
+
+    :return: json object mapping each found name to its status
+    """
+    result = {}
+    vc3_client = get_vc3_client()
+    vcs = vc3_client.listRequests()
     nodesets = vc3_client.listNodesets()
-    for vc in virtual_clusters:
-        if vc.name == name:
-            sanitized_obj = {'name': vc.name,
-                             'state': vc.state,
-                             'cluster': vc.cluster,
-                             'statusraw': vc.statusraw,
-                             'statusinfo': vc.statusinfo,
-                             'displayname': vc.displayname,
-                             'description': vc.description,
-                             'statereason': vc.state_reason,
-                             'action': vc.action,
-                             'headnode': vc.headnode}
-            if vc.statusinfo is not None:
-                sanitized_obj['statusinfo_error'] = vc.statusinfo[vc.statusinfo.keys()[
-                    0]]['error']
-                sanitized_obj['statusinfo_idle'] = vc.statusinfo[vc.statusinfo.keys()[
-                    0]]['idle']
-                sanitized_obj['statusinfo_node_number'] = vc.statusinfo[vc.statusinfo.keys()[
-                    0]]['node_number']
-                sanitized_obj['statusinfo_requested'] = vc.statusinfo[vc.statusinfo.keys()[
-                    0]]['requested']
-                sanitized_obj['statusinfo_running'] = vc.statusinfo[vc.statusinfo.keys()[
-                    0]]['running']
-            for nodeset in nodesets:
-                if nodeset.name == vc.headnode:
-                    sanitized_obj['headnode_app_host'] = nodeset.app_host
-                    sanitized_obj['headnode_app_type'] = nodeset.app_type
-                    sanitized_obj['headnode_state'] = nodeset.state
-                    sanitized_obj['headnode_state_reason'] = nodeset.state_reason
-
-            return flask.jsonify(sanitized_obj)
-    return flask.jsonify(result), 404
+    for name in requested_names():
+        vc = vcs.get(name)
+        if vc is not None:
+            result[name] = sanitize_virtual_cluster(vc, nodesets)
+    return flask.jsonify(result)
 
 
 @app.route('/rest/allocation/<name>', methods=['GET'])
@@ -65,19 +194,171 @@ def allocation(name):
     """
     result = {}
     vc3_client = get_vc3_client()
+    x = vc3_client.listAllocations().get(name)
+    if x is None:
+        return flask.jsonify(result), 404
+
+    sanitized_obj = sanitize_allocation(x, vc3_client.listResources())
+    return conditional_response(content_etag(sanitized_obj),
+                                lambda: flask.jsonify(sanitized_obj))
+
+
+@app.route('/rest/allocations', methods=['GET'])
+@authenticated
+def allocations():
+    """
+    Get information for every allocation named in ?names=a,b,c
+    from a single snapshot
+
+    :return: json object mapping each found name to its status
+    """
+    result = {}
+    vc3_client = get_vc3_client()
+    allocation_list = vc3_client.listAllocations()
+    resources = vc3_client.listResources()
+    for name in requested_names():
+        x = allocation_list.get(name)
+        if x is not None:
+            result[name] = sanitize_allocation(x, resources)
+    return flask.jsonify(result)
+
+
+def visible_statuses(vc3_client, user, names=None, admin=False):
+    """
+    Statuses of the virtual clusters and allocations a user may see
+
+    A user sees the virtual clusters they own or whose project they belong
+    to, and the allocations they own.  Portal admins see every one, as on
+    the admin page.
+
+    :param vc3_client: VC3 client instance
+    :param user: name of the session user
+    :param names: optional list of names to restrict the result to
+    :param admin: True if the user is a portal admin
+    :return: list of (kind, name, sanitized status) tuples
+    """
+    statuses = []
+    projects = vc3_client.listProjects()
+    nodesets = vc3_client.listNodesets()
+    for vc in vc3_client.listRequests():
+        if names and vc.name not in names:
+            continue
+        project = projects.get(vc.project)
+        if (admin or vc.owner == user or
+                (project is not None and
+                 (user in project.members or user == project.owner))):
+            statuses.append(('virtual_cluster', vc.name,
+                             sanitize_virtual_cluster(vc, nodesets)))
+    resources = vc3_client.listResources()
     allocations = vc3_client.listAllocations()
+    if not admin:
+        allocations = allocations.filter_by('owner', user)
     for x in allocations:
-        if x.name == name:
-            sanitized_obj = {'name': x.name,
-                             'state': x.state,
-                             'action': x.action,
-                             'owner': x.owner,
-                             'displayname': x.displayname,
-                             'description': x.description,
-                             'statereason': x.state_reason,
-                             'pubtoken': x.pubtoken}
-            if x.pubtoken:
-                sanitized_obj['pubtoken'] = base64.b64decode(
-                    x.pubtoken).rstrip('\n')
-            return flask.jsonify(sanitized_obj)
-    return flask.jsonify(result), 404
+        if names and x.name not in names:
+            continue
+        statuses.append(('allocation', x.name,
+                         sanitize_allocation(x, resources)))
+    return statuses
+
+
+@app.route('/rest/stream', methods=['GET'])
+@authenticated
+def stream():
+    """
+    Server-sent events stream of virtual cluster and allocation states
+
+    Sends the current status of everything the session may see (limited
+    to ?names=a,b,c if given), then only the entities whose state, action,
+    state reason, status info or headnode changed.  The stream ends after
+    VC3_STREAM_LIFETIME seconds and the browser reconnects.
+
+    A stream holds a server thread while it is open, so one worker process
+    serves at most VC3_STREAM_MAX of them at once; beyond that the request
+    is answered with 503 and the page polls instead.
+
+    :return: text/event-stream response
+    """
+    user = flask.session['name']
+    admin = flask.session['primary_identity'] in whitelist
+    names = requested_names()
+    interval = app.config.get('VC3_STREAM_INTERVAL', 2)
+    lifetime = app.config.get('VC3_STREAM_LIFETIME', 300)
+
+    def events():
+        sent = {}
+        started = time.time()
+        yield 'retry: 4000\n\n'
+        while time.time() - started < lifetime:
+            try:
+                # a fresh read each tick; the shared cache absorbs the load
+                statuses = visible_statuses(get_shared_vc3_client(), user,
+                                            names, admin)
+            except Exception as e:
+                app.logger.error("Couldn't refresh status stream: "
+                                 "{0}".format(e))
+                statuses = []
+            for kind, name, status in statuses:
+                fingerprint = [status.get(f) for f in STREAM_FIELDS[kind]]
+                if sent.get((kind, name)) != fingerprint:
+                    sent[(kind, name)] = fingerprint
+                    yield 'event: {0}\ndata: {1}\n\n'.format(
+                        kind, flask.json.dumps(status))
+            # also lets the server notice a closed connection
+            yield ': keep-alive\n\n'
+            time.sleep(interval)
+
+    if not stream_slots.acquire():
+        return flask.Response('Too many open status streams\n', 503,
+                              {'Retry-After': str(lifetime)},
+                              mimetype='text/plain')
+    response = flask.Response(flask.stream_with_context(events()),
+                              mimetype='text/event-stream',
+                              headers={'Cache-Control': 'no-cache',
+                                       'X-Accel-Buffering': 'no'})
+    response.call_on_close(stream_slots.release)
+    return response
+
+
+@app.route('/rest/stats', methods=['GET'])
+@authenticated
+def stats():
+    """
+    Report client pool, cache, fan-out, poller, user directory, portal
+    auth, login, token revocation, session, conditional GET and stream
+    counters to portal admins
+
+    :return: json counters
+    """
+    if flask.session['primary_identity'] not in whitelist:
+        return flask.jsonify({}), 403
+    return flask.jsonify({'client_pool': vc3_client_pool.stats(),
+                          'entity_cache': vc3_entity_cache.stats(),
+                          'fanout': vc3_fanout.stats(),
+                          'snapshot_poller': snapshot_poller.stats(),
+                          'authorization': vc3_authorizer.stats(),
+                          'builder_catalog': builder_catalog.stats(),
+                          'proxy_expirations': proxy_expirations.stats(),
+                          'page_cache': page_cache.stats(),
+                          'portal_auth': portal_auth.stats(),
+                          'oidc_keys': oidc_keys.stats(),
+                          'login': login_timings.stats(),
+                          'token_revocation': token_revoker.stats(),
+                          'user_directory': user_directory.stats(),
+                          'sessions': session_metrics.stats(),
+                          'conditional_get': conditional_stats.stats(),
+                          'streams': stream_slots.stats()})
+
+
+@app.route('/rest/page_cache', methods=['DELETE'])
+@authenticated
+def clear_page_cache():
+    """
+    Let portal admins drop every cached public page, e.g. after changing
+    templates without a restart
+
+    :return: json page cache counters
+    """
+    if flask.session['primary_identity'] not in whitelist:
+        return flask.jsonify({}), 403
+    page_cache.invalidate()
+    return flask.jsonify(page_cache.stats())
@@ -0,0 +1,213 @@
+import errno
+import hashlib
+import json
+import os
+import threading
+import time
+
+from Queue import Queue
+
+from portal import app
+from portal.private_files import private_directory
+
+
+class TokenRevoker(object):
+    """
+    Background revocation of the Globus tokens of users who logged out
+
+    Logout only queues the tokens.  A few daemon threads, started on first
+    use so a forking server does not inherit them, revoke them concurrently
+    with the Globus auth client that client_factory returns in each thread.
+    Failed revocations are retried with exponential backoff up to
+    max_attempts times.
+
+    With a backlog_dir, every queued token is also written there until it
+    was revoked or given up on.  Tokens a stopped or crashed worker left
+    behind are picked up again by resume(); revoking a token twice is
+    harmless.  The directory must belong to the portal's user and be
+    closed to everyone else; if it is not, tokens are only kept in memory.
+    """
+
+    def __init__(self, client_factory, backlog_dir=None, threads=4,
+                 max_attempts=5, retry_delay=10):
+        self.client_factory = client_factory
+        self.backlog_dir = backlog_dir
+        self.threads = threads
+        self.max_attempts = max_attempts
+        self.retry_delay = retry_delay
+        self._lock = threading.Lock()
+        self._queue = Queue()
+        self._workers = []
+        self._resumed = False
+        self.submitted = 0
+        self.revoked = 0
+        self.retries = 0
+        self.failures = 0
+        self._latency_total = 0.0
+        self._latency_max = 0.0
+
+    def _start(self):
+        with self._lock:
+            if self._workers:
+                return
+            for i in range(self.threads):
+                worker = threading.Thread(target=self._run,
+                                          name='token-revoker-{0}'.format(i))
+                worker.daemon = True
+                worker.start()
+                self._workers.append(worker)
+
+    def _backlog_path(self, token):
+        digest = hashlib.sha256(token).hexdigest()
+        return os.path.join(self.backlog_dir, digest + '.json')
+
+    def _save(self, job):
+        if self.backlog_dir is None:
+            return
+        path = self._backlog_path(job['token'])
+        temp = '{0}.{1}.{2}.tmp'.format(path, os.getpid(),
+                                        threading.current_thread().ident)
+        flags = (os.O_WRONLY | os.O_CREAT | os.O_EXCL |
+                 getattr(os, 'O_NOFOLLOW', 0))
+        try:
+            fd = os.open(temp, flags, 0o600)
+        except OSError as e:
+            if e.errno != errno.EEXIST:
+                raise
+            # left behind by an earlier save of this thread that failed
+            os.remove(temp)
+            fd = os.open(temp, flags, 0o600)
+        with os.fdopen(fd, 'w') as fh:
+            json.dump(job, fh)
+        os.rename(temp, path)
+
+    def _save_logged(self, job):
+        try:
+            self._save(job)
+        except (IOError, OSError) as e:
+            app.logger.error("Couldn't write {0} to the token revocation "
+                             "backlog: {1}".format(job['token_type'], e))
+
+    def _forget(self, token):
+        if self.backlog_dir is None:
+            return
+        self._forget_file(os.path.basename(self._backlog_path(token)))
+
+    def _forget_file(self, filename):
+        try:
+            os.remove(os.path.join(self.backlog_dir, filename))
+        except OSError as e:
+            if e.errno != errno.ENOENT:
+                raise
+
+    def submit(self, tokens):
+        """
+        Queue tokens for revocation and return at once
+
+        :param tokens: iterable of (token, token type hint) tuples, e.g.
+            (refresh_token, 'refresh_token')
+        """
+        self.resume()
+        now = time.time()
+        for token, token_type in tokens:
+            job = {'token': token, 'token_type': token_type,
+                   'submitted': now, 'attempts': 0}
+            self._save_logged(job)
+            with self._lock:
+                self.submitted += 1
+            self._queue.put(job)
+
+    def resume(self):
+        """
+        Queue the tokens left in the backlog by earlier workers, once, and
+        start the revoking threads
+
+        Called by the first logout, or earlier from a before_first_request
+        hook so the backlog does not wait for one.
+        """
+        with self._lock:
+            if self._resumed:
+                return
+            self._resumed = True
+        self._start()
+        if self.backlog_dir is None:
+            return
+        try:
+            private_directory(self.backlog_dir)
+        except OSError as e:
+            app.logger.error("Not using token revocation backlog {0}, "
+                             "keeping tokens in memory only: {1}".format(
+                                 self.backlog_dir, e))
+            self.backlog_dir = None
+            return
+        resumed = 0
+        for filename in os.listdir(self.backlog_dir):
+            if filename.endswith('.tmp'):
+                # half written by a worker that died before renaming it
+                self._forget_file(filename)
+                continue
+            if not filename.endswith('.json'):
+                continue
+            try:
+                with open(os.path.join(self.backlog_dir, filename)) as fh:
+                    job = json.load(fh)
+            except (IOError, ValueError):
+                continue
+            self._queue.put(job)
+            resumed += 1
+        if resumed:
+            app.logger.info("Resumed revoking {0} tokens from {1}".format(
+                resumed, self.backlog_dir))
+
+    def _retry(self, job):
+        delay = self.retry_delay * 2 ** (job['attempts'] - 1)
+        timer = threading.Timer(delay, self._queue.put, (job,))
+        timer.daemon = True
+        timer.start()
+
+    def _run(self):
+        while True:
+            job = self._queue.get()
+            job['attempts'] += 1
+            try:
+                self.client_factory().oauth2_revoke_token(
+                    job['token'],
+                    additional_params={'token_type_hint': job['token_type']})
+            except Exception as e:
+                if job['attempts'] < self.max_attempts:
+                    with self._lock:
+                        self.retries += 1
+                    app.logger.warning("Couldn't revoke {0} (attempt {1}), "
+                                       "retrying: {2}".format(
+                                           job['token_type'],
+                                           job['attempts'], e))
+                    self._save_logged(job)
+                    self._retry(job)
+                    continue
+                with self._lock:
+                    self.failures += 1
+                app.logger.error("Gave up revoking {0} after {1} attempts: "
+                                 "{2}".format(job['token_type'],
+                                              job['attempts'], e))
+            else:
+                latency = time.time() - job['submitted']
+                with self._lock:
+                    self.revoked += 1
+                    self._latency_total += latency
+                    self._latency_max = max(self._latency_max, latency)
+            try:
+                self._forget(job['token'])
+            except OSError as e:
+                app.logger.error("Couldn't remove revoked token from the "
+                                 "backlog: {0}".format(e))
+
+    def stats(self):
+        with self._lock:
+            return {'submitted': self.submitted,
+                    'revoked': self.revoked,
+                    'retries': self.retries,
+                    'failures': self.failures,
+                    'queued': self._queue.qsize(),
+                    'latency_mean': (self._latency_total / self.revoked
+                                     if self.revoked else 0.0),
+                    'latency_max': self._latency_max}
@@ -0,0 +1,326 @@
+import os
+import sqlite3
+import threading
+import time
+
+from flask.sessions import (SecureCookieSession, SecureCookieSessionInterface,
+                            SessionInterface, SessionMixin,
+                            session_json_serializer)
+from itsdangerous import BadSignature, Signer
+from werkzeug.datastructures import CallbackDict
+
+from portal.private_files import open_private, private_directory
+
+
+class SessionStore(object):
+    """
+    Where server-side sessions are kept
+
+    Subclasses store each session's serialized data under its session id,
+    e.g. in a database or a cache every worker host can reach.
+    """
+
+    def load(self, sid):
+        """
+        :param sid: session id
+        :return: tuple of (serialized data, expiration in epoch seconds), or
+            None if there is no such unexpired session
+        """
+        raise NotImplementedError
+
+    def save(self, sid, data, expires):
+        """
+        :param sid: session id
+        :param data: serialized session data
+        :param expires: epoch seconds after which the session may be dropped
+        """
+        raise NotImplementedError
+
+    def delete(self, sid):
+        raise NotImplementedError
+
+
+class SQLiteSessionStore(SessionStore):
+    """
+    Sessions in a local SQLite database, shared by the workers of one host
+
+    Every thread uses its own connection.  Expired sessions are purged at
+    most once every purge_interval seconds.
+
+    Sessions hold tokens, so the database must be readable by the portal's
+    user only, in a directory nobody else may write to: a new database is
+    created with mode 0600, and an existing one, or the directory, that is
+    owned by someone else or open to other users is refused.
+    """
+
+    def __init__(self, path, purge_interval=300):
+        self.path = path
+        self.purge_interval = purge_interval
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._purged = 0
+        # SQLite creates its -wal and -shm files next to the database
+        private_directory(os.path.dirname(os.path.abspath(path)), 0o022)
+        os.close(open_private(path, os.O_RDWR))
+        self._connection().execute(
+            'CREATE TABLE IF NOT EXISTS sessions (id TEXT PRIMARY KEY, '
+            'data TEXT NOT NULL, expires REAL NOT NULL)')
+
+    def _connection(self):
+        connection = getattr(self._local, 'connection', None)
+        if connection is None:
+            connection = sqlite3.connect(self.path, timeout=10,
+                                         isolation_level=None)
+            connection.execute('PRAGMA journal_mode=WAL')
+            self._local.connection = connection
+        return connection
+
+    def load(self, sid):
+        row = self._connection().execute(
+            'SELECT data, expires FROM sessions WHERE id = ? AND expires > ?',
+            (sid, time.time())).fetchone()
+        return tuple(row) if row else None
+
+    def save(self, sid, data, expires):
+        connection = self._connection()
+        connection.execute(
+            'INSERT OR REPLACE INTO sessions (id, data, expires) '
+            'VALUES (?, ?, ?)', (sid, data, expires))
+        now = time.time()
+        with self._lock:
+            purge = self._purged + self.purge_interval < now
+            if purge:
+                self._purged = now
+        if purge:
+            connection.execute('DELETE FROM sessions WHERE expires < ?',
+                               (now,))
+
+    def delete(self, sid):
+        self._connection().execute('DELETE FROM sessions WHERE id = ?',
+                                   (sid,))
+
+
+class ServerSession(CallbackDict, SessionMixin):
+    """
+    Session data kept in a SessionStore under a random session id
+    """
+
+    def __init__(self, initial=None, sid=None, expires=None, stored=None):
+        def on_update(self):
+            self.modified = True
+            self.accessed = True
+
+        super(ServerSession, self).__init__(initial, on_update)
+        self.sid = sid
+        self.expires = expires
+        # serialized data as loaded, to tell real changes from rewrites
+        self.stored = stored
+        self.previous_sid = None
+        self.modified = False
+        self.accessed = False
+
+    # reads mark the session accessed too, so responses that depend on it
+    # get Vary: Cookie, as with SecureCookieSession
+
+    def __getitem__(self, key):
+        self.accessed = True
+        return super(ServerSession, self).__getitem__(key)
+
+    def get(self, key, default=None):
+        self.accessed = True
+        return super(ServerSession, self).get(key, default)
+
+    def setdefault(self, key, default=None):
+        self.accessed = True
+        return super(ServerSession, self).setdefault(key, default)
+
+    def regenerate(self):
+        """
+        Move the session to a new id, e.g. on login, so an id planted
+        before the login is worthless afterwards
+        """
+        if self.sid is not None and self.previous_sid is None:
+            self.previous_sid = self.sid
+        self.sid = None
+        self.modified = True
+
+
+def new_session_id():
+    return os.urandom(24).encode('hex')
+
+
+class SessionMetrics(object):
+    """
+    Size of the session cookies browsers send and time spent opening
+    sessions, i.e. verifying and deserializing the cookie, or loading the
+    session from the store
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.opened = 0
+        self.cookie_bytes = 0
+        self.cookie_bytes_max = 0
+        self.open_seconds = 0.0
+        self.stored_bytes = 0
+        self.saved = 0
+
+    def record_open(self, cookie, seconds):
+        size = len(cookie or '')
+        with self._lock:
+            self.opened += 1
+            self.cookie_bytes += size
+            self.cookie_bytes_max = max(self.cookie_bytes_max, size)
+            self.open_seconds += seconds
+
+    def record_save(self, data):
+        with self._lock:
+            self.saved += 1
+            self.stored_bytes += len(data)
+
+    def stats(self):
+        with self._lock:
+            opened = self.opened or 1
+            return {'opened': self.opened,
+                    'cookie_bytes_mean': float(self.cookie_bytes) / opened,
+                    'cookie_bytes_max': self.cookie_bytes_max,
+                    'open_seconds_mean': self.open_seconds / opened,
+                    'saved': self.saved,
+                    'stored_bytes_mean': (float(self.stored_bytes) /
+                                          (self.saved or 1))}
+
+
+class CookieSession(SecureCookieSession):
+
+    def regenerate(self):
+        # a cookie session has no id to move
+        pass
+
+
+class MeasuredCookieSessionInterface(SecureCookieSessionInterface):
+    """
+    Flask's signed cookie sessions, recording SessionMetrics
+    """
+
+    session_class = CookieSession
+
+    def __init__(self, metrics):
+        self.metrics = metrics
+
+    def open_session(self, app, request):
+        start = time.time()
+        session = super(MeasuredCookieSessionInterface, self).open_session(
+            app, request)
+        self.metrics.record_open(request.cookies.get(app.session_cookie_name),
+                                 time.time() - start)
+        return session
+
+
+class ServerSideSessionInterface(SessionInterface):
+    """
+    Sessions kept in a SessionStore; the cookie only carries the signed
+    session id
+
+    A session is written back only when its data changed, or to push its
+    expiration forward at most once every touch_interval seconds, so the
+    REST polls of an open page neither upload nor rewrite the session.
+    """
+
+    salt = 'vc3-session-id'
+    serializer = session_json_serializer
+
+    def __init__(self, store, metrics, touch_interval=3600):
+        self.store = store
+        self.metrics = metrics
+        self.touch_interval = touch_interval
+
+    def _signer(self, app):
+        return Signer(app.secret_key, salt=self.salt)
+
+    def _lifetime(self, app):
+        return app.permanent_session_lifetime.total_seconds()
+
+    def open_session(self, app, request):
+        if not app.secret_key:
+            return None
+        start = time.time()
+        cookie = request.cookies.get(app.session_cookie_name)
+        session = ServerSession()
+        if cookie:
+            try:
+                sid = self._signer(app).unsign(cookie)
+            except BadSignature:
+                sid = None
+            stored = self.store.load(sid) if sid else None
+            if stored is not None:
+                data, expires = stored
+                session = ServerSession(self.serializer.loads(data), sid,
+                                        expires, data)
+        self.metrics.record_open(cookie, time.time() - start)
+        return session
+
+    def save_session(self, app, session, response):
+        domain = self.get_cookie_domain(app)
+        path = self.get_cookie_path(app)
+        if session.previous_sid is not None:
+            self.store.delete(session.previous_sid)
+            session.previous_sid = None
+        if not session:
+            if session.modified:
+                if session.sid is not None:
+                    self.store.delete(session.sid)
+                response.delete_cookie(app.session_cookie_name,
+                                       domain=domain, path=path)
+            return
+
+        if session.accessed:
+            response.vary.add('Cookie')
+        now = time.time()
+        touch = (session.expires is not None and
+                 session.expires - self._lifetime(app) + self.touch_interval
+                 < now)
+        if session.sid is not None and not session.modified and not touch:
+            return
+
+        data = self.serializer.dumps(dict(session))
+        if session.sid is not None and data == session.stored and not touch:
+            # views often set keys to the values they already have
+            return
+        new_sid = session.sid is None
+        if new_sid:
+            session.sid = new_session_id()
+        session.stored = data
+        session.expires = now + self._lifetime(app)
+        self.store.save(session.sid, data, session.expires)
+        self.metrics.record_save(data)
+        if not (new_sid or session.permanent):
+            return
+        response.set_cookie(app.session_cookie_name,
+                            self._signer(app).sign(session.sid),
+                            expires=self.get_expiration_time(app, session),
+                            httponly=self.get_cookie_httponly(app),
+                            domain=domain, path=path,
+                            secure=self.get_cookie_secure(app),
+                            samesite=self.get_cookie_samesite(app))
+
+
+def configure_sessions(app):
+    """
+    Install the session interface chosen by the config
+
+    Sessions are kept in VC3_SESSION_STORE, a SessionStore instance, or
+    else in a SQLite database at VC3_SESSION_DB.  With neither configured
+    they stay in signed cookies.  Either way SessionMetrics are recorded.
+
+    :param app: Flask application
+    :return: the SessionMetrics
+    """
+    metrics = SessionMetrics()
+    store = app.config.get('VC3_SESSION_STORE')
+    if store is None and app.config.get('VC3_SESSION_DB'):
+        store = SQLiteSessionStore(app.config['VC3_SESSION_DB'])
+    if store is None:
+        app.session_interface = MeasuredCookieSessionInterface(metrics)
+    else:
+        app.session_interface = ServerSideSessionInterface(store, metrics)
+    return metrics
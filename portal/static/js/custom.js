@@ -677,3 +677,57 @@ $(function() {
 // $(document).ready(function() {
 //   $('#example').DataTable();
 // });
+
+// Keep the state of virtual clusters or allocations current.
+// Subscribes to the /rest/stream server-sent events and hands each pushed
+// status to update(name, data).  When the browser has no EventSource, or
+// the stream cannot be opened or reopened, e.g. because the server has too
+// many streams open already, poll() is called once to start polling.
+function watch_states(kind, names, update, poll){
+  if(names.length == 0){
+    return;
+  }
+  if(!window.EventSource){
+    poll();
+    return;
+  }
+  var opened = false;
+  var source = new EventSource("/rest/stream?names=" + encodeURIComponent(names.join(",")));
+  source.onopen = function(){
+    opened = true;
+  };
+  source.addEventListener(kind, function(e){
+    var data = JSON.parse(e.data);
+    update(data.name, data);
+  });
+  source.onerror = function(){
+    // once opened, EventSource reconnects on its own unless the server
+    // refuses the reconnection
+    if(!opened || source.readyState == EventSource.CLOSED){
+      source.close();
+      poll();
+    }
+  };
+}
+
+// Count down to a proxy expiration, given in seconds since the epoch.
+// Calling it again for the same element replaces the previous countdown.
+function proxy_countdown(element, expires_at){
+  var el = $(element);
+  clearInterval(el.data("countdown"));
+  if(expires_at == null){
+    return;
+  }
+  var tick = function(){
+    var left = Math.floor(expires_at - new Date().getTime() / 1000);
+    if(left <= 0){
+      el.html("Expired");
+      clearInterval(el.data("countdown"));
+      return;
+    }
+    el.html(Math.floor(left / 3600) + " hours, " + Math.floor(left % 3600 / 60) +
+            " minutes and " + left % 60 + " seconds.");
+  };
+  tick();
+  el.data("countdown", setInterval(tick, 1000));
+}
@@ -0,0 +1,60 @@
+import time
+
+from jinja2 import FileSystemBytecodeCache, TemplateError
+
+from portal.private_files import private_directory
+
+
+def configure_templates(app):
+    """
+    Pick the template mode before the Jinja environment is created
+
+    Production mode is off unless VC3_PRODUCTION_TEMPLATES is set.  Then
+    templates are not checked for changes on every render and compiled
+    templates are kept in a bytecode cache: VC3_TEMPLATE_CACHE_DIR, which
+    must be private to the portal's user, or else Jinja's own per-user
+    cache directory in the system temp directory.  Otherwise templates
+    are reloaded whenever they change, as they always were.
+
+    :param app: Flask application
+    :return: True if production mode is on
+    """
+    production = app.config.get('VC3_PRODUCTION_TEMPLATES', False)
+    if production:
+        app.config['TEMPLATES_AUTO_RELOAD'] = False
+        cache_dir = app.config.get('VC3_TEMPLATE_CACHE_DIR')
+        if cache_dir is None:
+            # Jinja creates it with mode 0700 and checks its owner
+            bytecode_cache = FileSystemBytecodeCache()
+        else:
+            bytecode_cache = FileSystemBytecodeCache(
+                private_directory(cache_dir))
+        app.jinja_options = dict(app.jinja_options,
+                                 bytecode_cache=bytecode_cache)
+    else:
+        app.config['TEMPLATES_AUTO_RELOAD'] = True
+    return production
+
+
+def precompile_templates(app):
+    """
+    Compile every template up front so no request pays for it
+
+    Templates that fail to compile are logged and left to fail when they
+    are rendered, as before.
+
+    :param app: Flask application
+    :return: number of templates compiled
+    """
+    start = time.time()
+    compiled = 0
+    for name in app.jinja_env.list_templates(extensions=['html']):
+        try:
+            app.jinja_env.get_template(name)
+            compiled += 1
+        except TemplateError as e:
+            app.logger.error("Couldn't compile template {0}: "
+                             "{1}".format(name, e))
+    app.logger.info("Compiled {0} templates in {1:.2f}s".format(
+        compiled, time.time() - start))
+    return compiled
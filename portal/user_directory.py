@@ -0,0 +1,127 @@
+import copy
+import threading
+import time
+
+from collections import OrderedDict
+
+from portal.client_cache import RequestScopedClient
+
+
+class UserDirectory(object):
+    """
+    VC3 users indexed by Globus identity id
+
+    The index is built from one listUsers() and kept until the entity
+    cache's 'user' generation changes or ttl seconds pass, so a lookup
+    does not depend on the number of registered users.  Users stored
+    through store() are updated in the index in place instead of forcing
+    a rebuild.
+
+    Each worker process has its own index, which does not see users other
+    workers registered until it expires.  So a lookup that finds nobody
+    lists the users afresh first, at most once every min_refresh seconds
+    per identity; the last max_refreshed identities that missed are
+    remembered for that.
+    """
+
+    def __init__(self, cache, ttl=300, min_refresh=30, max_refreshed=1024):
+        self.cache = cache
+        self.ttl = ttl
+        self.min_refresh = min_refresh
+        self.max_refreshed = max_refreshed
+        self._lock = threading.Lock()
+        self._users = None
+        self._generation = None
+        self._expires = 0
+        # identity id to the time a miss on it last listed the users
+        self._refreshed = OrderedDict()
+        self.builds = 0
+        self.lookups = 0
+        self.refreshes = 0
+        self.stores = 0
+
+    def _index(self, vc3_client):
+        generation = self.cache.generation('user')
+        with self._lock:
+            if (self._users is not None and generation == self._generation
+                    and self._expires > time.time()):
+                return self._users
+        users = {}
+        for user in vc3_client.listUsers():
+            users[user.identity_id] = user
+        with self._lock:
+            # a write while listing means the list may already be stale
+            if generation == self.cache.generation('user'):
+                self._users = users
+                self._generation = generation
+                self._expires = time.time() + self.ttl
+                self.builds += 1
+        return users
+
+    def get(self, vc3_client, identity_id):
+        """
+        :param vc3_client: VC3 client used to list users on a rebuild
+        :param identity_id: Globus identity id, e.g.
+            session['primary_identity']
+        :return: copy of the VC3 user with that identity, or None
+        """
+        user = self._index(vc3_client).get(identity_id)
+        if user is None and self._may_refresh(identity_id):
+            # the user may have registered through another worker
+            self.cache.invalidate('user')
+            if isinstance(vc3_client, RequestScopedClient):
+                vc3_client.invalidate('user')
+            user = self._index(vc3_client).get(identity_id)
+        with self._lock:
+            self.lookups += 1
+        return copy.deepcopy(user)
+
+    def _may_refresh(self, identity_id):
+        now = time.time()
+        with self._lock:
+            refreshed = self._refreshed.get(identity_id)
+            if refreshed is not None and refreshed + self.min_refresh > now:
+                return False
+            self._refreshed.pop(identity_id, None)
+            self._refreshed[identity_id] = now
+            # kept in refresh order, so expired entries are at the front
+            while self._refreshed:
+                oldest = next(iter(self._refreshed.values()))
+                if (len(self._refreshed) <= self.max_refreshed and
+                        oldest + self.min_refresh > now):
+                    break
+                self._refreshed.popitem(last=False)
+            self.refreshes += 1
+            return True
+
+    def store(self, vc3_client, user):
+        """
+        Store a user with vc3_client.storeUser() and update the index
+
+        :param vc3_client: VC3 client whose storeUser invalidates the
+            'user' kind of the entity cache
+        :param user: VC3 user to store
+        """
+        generation = self.cache.generation('user')
+        vc3_client.storeUser(user)
+        with self._lock:
+            self.stores += 1
+            if (self._users is None or self._generation != generation or
+                    self.cache.generation('user') != generation + 1):
+                # another write got in between; rebuild on next lookup
+                self._users = None
+                return
+            self._users = dict(self._users)
+            for identity_id, known in self._users.items():
+                if known.name == user.name:
+                    del self._users[identity_id]
+            self._users[user.identity_id] = copy.deepcopy(user)
+            self._generation = generation + 1
+
+    def stats(self):
+        with self._lock:
+            return {'users': len(self._users or ()),
+                    'builds': self.builds,
+                    'lookups': self.lookups,
+                    'refreshes': self.refreshes,
+                    'stores': self.stores}
@@ -1,32 +1,39 @@
-from flask import redirect, request, session, url_for, flash
-from threading import Lock
-from ConfigParser import SafeConfigParser
+from flask import (redirect, request, session, url_for, flash, g,
+                   has_request_context)
 
 import os
 import errno
 
-import globus_sdk
-
-from vc3client import client
-
 try:
     from urllib.parse import urlparse, urljoin
 except ImportError:
     from urlparse import urlparse, urljoin
 
-from cryptography import x509
-from cryptography.hazmat.backends import default_backend
 import datetime
 
 from portal import app
+from portal.client_pool import VC3ClientPool
+from portal.client_cache import (EntityCache, RequestScopedClient,
+                                 SharedCacheClient)
+from portal.poller import SnapshotPoller
+from portal.fanout import FanOut, normalize_call
+from portal.authorization import Authorizer
+from portal.builder_catalog import BuilderCatalogService
+from portal.proxy_expiration import ProxyExpirationCache
+from portal.page_cache import PageCache
+from portal.globus_auth import OIDCKeyCache, PhaseTimings, PortalAuthClient
+from portal.revocation import TokenRevoker
+from portal.user_directory import UserDirectory
 
 
 def load_portal_client():
-    """Create an AuthClient for the portal"""
-    # return globus_sdk.ConfidentialAppAuthClient(
-    #     app.config['PORTAL_CLIENT_ID'], app.config['PORTAL_CLIENT_SECRET'])
-    return globus_sdk.ConfidentialAppAuthClient(
-        app.config['PORTAL_CLIENT_ID'], app.config['PORTAL_CLIENT_SECRET'])
+    """
+    Return the portal's Globus AuthClient for the calling thread
+
+    The client is built once per worker thread and reused, along with its
+    HTTP connections.
+    """
+    return portal_auth.client()
 
 
 def is_safe_redirect_url(target):
@@ -56,51 +63,153 @@ def get_portal_tokens(
     """
     Uses the client_credentials grant to get access tokens on the
     Portal's "client identity."
+
+    Tokens are cached per set of scopes until shortly before they expire.
+
+    :return: dict of resource server to dict of 'token', 'scope' and
+        'expires_at'
     """
-    with get_portal_tokens.lock:
-        if not get_portal_tokens.access_tokens:
-            get_portal_tokens.access_tokens = {}
+    return portal_auth.tokens(scopes)
 
-        scope_string = ' '.join(scopes)
 
-        client = load_portal_client()
-        tokens = client.oauth2_client_credentials_tokens(
-            requested_scopes=scope_string)
+def get_vc3_client():
+    """
+    Return a VC3 client instance from the per-worker client pool
 
-        # walk all resource servers in the token response (includes the
-        # top-level server, as found in tokens.resource_server), and store the
-        # relevant Access Tokens
-        for resource_server, token_info in tokens.by_resource_server.items():
-            get_portal_tokens.access_tokens.update({
-                resource_server: {
-                    'token': token_info['access_token'],
-                    'scope': token_info['scope'],
-                    'expires_at': token_info['expires_at_seconds']
-                }
-            })
+    Reads go through the shared entity cache.  Inside a request the client
+    is also wrapped in a memo kept on flask.g, so every list* and get* call
+    is made at most once per request.
 
-        return get_portal_tokens.access_tokens
+    :return: VC3 client instance on success
+    """
+    shared_client = get_shared_vc3_client()
+    if not has_request_context():
+        return shared_client
+    vc3_client = getattr(g, 'vc3_client', None)
+    if vc3_client is None:
+        vc3_client = g.vc3_client = RequestScopedClient(shared_client)
+    return vc3_client
 
 
-def get_vc3_client():
+def get_shared_vc3_client():
     """
-    Return a VC3 client instance
+    Return a VC3 client instance reading through the shared entity cache
+    only, without the per-request memo
+
+    Use it where one request needs fresh data more than once, e.g. in a
+    long-lived stream.
 
     :return: VC3 client instance on success
     """
-    c = SafeConfigParser()
-    c.readfp(open(app.config['VC3_CLIENT_CONFIG']))
+    return SharedCacheClient(vc3_client_pool.get(), vc3_entity_cache)
 
-    try:
-        client_api = client.VC3ClientAPI(c)
-        return client_api
-    except Exception as e:
-        app.logger.error("Couldn't get vc3 client: {0}".format(e))
-        raise
 
+def fetch_concurrently(*calls, **kwargs):
+    """
+    Issue independent VC3 client calls concurrently
+
+    Each call runs in a fan-out worker on that worker's own pooled client.
+    Inside a request the results also land in the per-request memo, so
+    later calls for the same data are answered locally.
 
-get_portal_tokens.lock = Lock()
-get_portal_tokens.access_tokens = None
+    :param calls: method names, e.g. 'listUsers', or (method name, kwargs)
+        tuples, e.g. ('getProject', {'projectname': name})
+    :param timeout: seconds each call may take, defaults to
+        VC3_FANOUT_TIMEOUT
+    :return: list of results, in the order of calls
+    """
+    timeout = kwargs.get('timeout')
+    calls = [normalize_call(call) for call in calls]
+
+    def run(pending):
+        return vc3_fanout.run(pending, timeout)
+
+    if not has_request_context():
+        return run(calls)
+    return get_vc3_client().fetch_many(run, calls)
+
+
+# Globus Auth clients of the worker threads and the portal's own tokens,
+# refreshed VC3_PORTAL_TOKEN_REFRESH_MARGIN seconds before they expire
+portal_auth = PortalAuthClient(
+    app.config['PORTAL_CLIENT_ID'], app.config['PORTAL_CLIENT_SECRET'],
+    refresh_margin=app.config.get('VC3_PORTAL_TOKEN_REFRESH_MARGIN', 60))
+
+# Globus Auth's OpenID configuration and ID token signing keys
+oidc_keys = OIDCKeyCache(ttl=app.config.get('VC3_OIDC_CACHE_TTL', 3600))
+
+# Time spent in each phase of authcallback logins
+login_timings = PhaseTimings('Login')
+
+# Tokens of users who logged out, revoked in the background; they survive
+# a restart only with a VC3_REVOCATION_BACKLOG directory
+token_revoker = TokenRevoker(
+    load_portal_client,
+    app.config.get('VC3_REVOCATION_BACKLOG'),
+    threads=app.config.get('VC3_REVOCATION_THREADS', 4),
+    max_attempts=app.config.get('VC3_REVOCATION_MAX_ATTEMPTS', 5),
+    retry_delay=app.config.get('VC3_REVOCATION_RETRY_DELAY', 10))
+app.before_first_request(token_revoker.resume)
+
+vc3_client_pool = VC3ClientPool(app.config['VC3_CLIENT_CONFIG'])
+
+# Users, resources, nodeinfo and environments rarely change; requests,
+# nodesets and allocations change state while the pages poll them.
+VC3_CACHE_TTLS = {'user': 300, 'resource': 600, 'nodeinfo': 600,
+                  'environment': 300, 'cluster': 60, 'project': 30,
+                  'allocation': 5, 'request': 2, 'nodeset': 2}
+VC3_CACHE_TTLS.update(app.config.get('VC3_CACHE_TTLS', {}))
+
+# Optionally keep requests, nodesets, allocations and projects refreshed in
+# the background; handlers then serve listed snapshots up to
+# VC3_POLLER_MAX_AGE old, while single get* entities keep their own TTLs.
+VC3_POLLER_ENABLED = app.config.get('VC3_POLLER_ENABLED', False)
+VC3_POLLER_MAX_AGE = app.config.get('VC3_POLLER_MAX_AGE', 30)
+VC3_LIST_TTLS = {}
+if VC3_POLLER_ENABLED:
+    for kind in SnapshotPoller.COLLECTIONS:
+        VC3_LIST_TTLS[kind] = VC3_POLLER_MAX_AGE
+
+vc3_entity_cache = EntityCache(
+    ttls=VC3_CACHE_TTLS,
+    list_ttls=VC3_LIST_TTLS,
+    max_entries=app.config.get('VC3_CACHE_MAX_ENTRIES', 1024))
+
+snapshot_poller = SnapshotPoller(
+    vc3_client_pool.get, vc3_entity_cache,
+    interval=app.config.get('VC3_POLLER_INTERVAL', 5),
+    max_age=VC3_POLLER_MAX_AGE)
+if VC3_POLLER_ENABLED:
+    snapshot_poller.start()
+
+# Project and allocation checks of the decorators; grants are rebuilt after
+# VC3_AUTHZ_TTL seconds or as soon as projects or allocations are written.
+vc3_authorizer = Authorizer(vc3_entity_cache,
+                            ttl=app.config.get('VC3_AUTHZ_TTL', 15))
+
+# vc3-builder recipe, section and OS lists, loaded once and kept in memory
+builder_catalog = BuilderCatalogService(
+    app.config.get('VC3_BUILDER', '/usr/bin/vc3-builder'),
+    ttl=app.config.get('VC3_BUILDER_CATALOG_TTL', 3600))
+
+# VC3 users by Globus identity id, for login, profile and portal home
+user_directory = UserDirectory(
+    vc3_entity_cache, ttl=VC3_CACHE_TTLS['user'],
+    min_refresh=app.config.get('VC3_USER_DIRECTORY_MIN_REFRESH', 30))
+
+# Parsed expiration times of allocation proxies, by token digest
+proxy_expirations = ProxyExpirationCache()
+
+# Rendered public pages for anonymous visitors
+page_cache = PageCache(vc3_entity_cache,
+                       ttl=app.config.get('VC3_PAGE_CACHE_TTL', 300),
+                       max_entries=app.config.get('VC3_PAGE_CACHE_MAX_ENTRIES',
+                                                  256))
+
+vc3_fanout = FanOut(
+    get_shared_vc3_client,
+    threads=app.config.get('VC3_FANOUT_THREADS', 8),
+    timeout=app.config.get('VC3_FANOUT_TIMEOUT', 30))
 
 
 def project_validated(name):
@@ -110,39 +219,18 @@ def project_validated(name):
     :param name: name of project to be checked
     :return: True if user exists in project or False otherwise
     """
-    vc3_client = get_vc3_client()
-    # Grab project by name
-    project = vc3_client.getProject(projectname=name)
-
-    # Checks to see if user is in project
-    if (session['name'] in project.members or
-            session['name'] == project.owner):
-        return True
-    else:
-        return False
+    return vc3_authorizer.in_project(get_vc3_client(), session['name'], name)
 
 
 def project_in_vc(name):
     """
-    Checks to see if user exists within specific project associated with VC
+    Checks to see if user exists within any project owned by the owner of a
+    VC
 
     :param name: name of VC to be checked
-    :return: True if user exists in project or False otherwise
+    :return: True if user exists in such a project or False otherwise
     """
-    vc3_client = get_vc3_client()
-    projects = vc3_client.listProjects()
-    vc = vc3_client.getRequest(requestname=name)
-    vc_owner_projects = []
-
-    for project in projects:
-        if vc.owner == project.owner:
-            vc_owner_projects.append(project)
-
-    for p in vc_owner_projects:
-        if (session['name'] in p.members or session['name'] == p.owner):
-            return True
-        else:
-            return False
+    return vc3_authorizer.in_vc(get_vc3_client(), session['name'], name)
 
 
 def allocation_script_for_resource(allocation_name, output_path):
@@ -218,22 +306,38 @@ exit 0
 """.format(pubkey)
         fh.write(script)
 
-def get_proxy_expiration_time(proxystr, method):
+
+def get_proxy_expiration_time(privtoken, method):
+    """
+    Time left before an allocation's proxy expires, for display
+
+    :param privtoken: base64 encoded proxy as stored in the allocation
+    :param method: access method of the resource, 'gsissh' or 'sshproxy'
+    :return: readable time left
+    """
     if method == 'gsissh':
-        return get_proxy_expiration_time_gsissh(proxystr)
+        return get_proxy_expiration_time_gsissh(privtoken)
     elif method == 'sshproxy':
-        return get_proxy_expiration_time_sshproxy(proxystr)
+        return get_proxy_expiration_time_sshproxy(privtoken)
     else:
         return "None"
 
-def get_proxy_expiration_time_gsissh(proxystr):
-    try:
-        cert = x509.load_pem_x509_certificate(proxystr, default_backend())
-    except Exception as e:
-        app.logger.error("Error while reading proxy {0}".format(e))
-        return 'Could not read proxy expiration time'
-        
-    cert_expire = cert.not_valid_after
+
+def get_proxy_expiration(privtoken, method):
+    """
+    :return: naive UTC datetime at which the proxy expires, None if it
+        never expires or cannot be read
+    """
+    if not privtoken or method not in ('gsissh', 'sshproxy'):
+        return None
+    return proxy_expirations.not_valid_after(privtoken, method)[1]
+
+
+def format_time_left(cert_expire):
+    """
+    :param cert_expire: naive UTC datetime
+    :return: time left until cert_expire, as hours, minutes and seconds
+    """
     now = datetime.datetime.utcnow()
     exp_time = cert_expire - now
     time_s = exp_time.total_seconds()
@@ -241,7 +345,22 @@ def get_proxy_expiration_time_gsissh(proxystr):
                                                                                   minutes=int(time_s % 3600 / 60),
                                                                                   seconds=int(time_s % 60))
 
-    return expiration 
+    return expiration
 
-def get_proxy_expiration_time_sshproxy(proxystr):
-    return "Not implementet yet"
+
+def get_proxy_expiration_time_gsissh(privtoken):
+    readable, cert_expire = proxy_expirations.not_valid_after(privtoken,
+                                                              'gsissh')
+    if not readable:
+        return 'Could not read proxy expiration time'
+    return format_time_left(cert_expire)
+
+
+def get_proxy_expiration_time_sshproxy(privtoken):
+    readable, cert_expire = proxy_expirations.not_valid_after(privtoken,
+                                                              'sshproxy')
+    if not readable:
+        return 'Could not read proxy expiration time'
+    if cert_expire is None:
+        return 'Never'
+    return format_time_left(cert_expire)
@@ -0,0 +1,91 @@
+class ViewRow(object):
+    """
+    An entity together with the related entities a template displays
+
+    Attributes of the wrapped entity are readable as usual; joined fields
+    are set on the row and shadow entity attributes of the same name, so
+    the entity itself is never modified.
+    """
+
+    def __init__(self, entity, **joined):
+        self._entity = entity
+        self.__dict__.update(joined)
+
+    def __getattr__(self, attr):
+        return getattr(self._entity, attr)
+
+
+def request_rows(vc3_requests, nodesets, clusters):
+    """
+    Join virtual clusters with their headnode, nodeset and cluster
+
+    :param vc3_requests: collection of virtual clusters
+    :param nodesets: EntityCollection of nodesets
+    :param clusters: EntityCollection of cluster templates
+    :return: list of ViewRow with headnode, nodesetinfo and clusterinfo
+    """
+    rows = []
+    for vc3_request in vc3_requests:
+        headnode = None
+        if vc3_request.headnode:
+            headnode = nodesets.get(vc3_request.headnode)
+        rows.append(ViewRow(vc3_request,
+                            headnode=headnode,
+                            nodesetinfo=nodesets.get(vc3_request.cluster),
+                            clusterinfo=clusters.get(vc3_request.cluster)))
+    return rows
+
+
+def resource_rows(vc3_client, resources):
+    """
+    Join public resources with their nodeinfo
+
+    Each distinct nodeinfo is fetched once, however many resources share
+    it.
+
+    :param vc3_client: VC3 client instance
+    :param resources: collection of resources
+    :return: list of ViewRow with node_info
+    """
+    nodeinfos = {}
+    rows = []
+    for resource in resources:
+        nodeinfo = None
+        if getattr(resource, 'public', False) and resource.nodeinfo:
+            if resource.nodeinfo not in nodeinfos:
+                nodeinfos[resource.nodeinfo] = vc3_client.getNodeinfo(
+                    nodeinfoName=resource.nodeinfo)
+            nodeinfo = nodeinfos[resource.nodeinfo]
+        rows.append(ViewRow(resource, node_info=nodeinfo))
+    return rows
+
+
+def environment_rows(vc3_client, names):
+    """
+    Resolve environment names, e.g. those of a virtual cluster
+
+    :param vc3_client: VC3 client instance
+    :param names: list of environment names
+    :return: list of environment entities in the same order
+    """
+    if not names:
+        return []
+    environments = vc3_client.listEnvironments()
+    rows = []
+    for name in names:
+        environment = environments.get(name)
+        if environment is None:
+            environment = vc3_client.getEnvironment(environmentname=name)
+        rows.append(environment)
+    return rows
+
+
+def reject_template_client(*args, **kwargs):
+    """
+    Stand-in for get_vc3_client in the Jinja globals
+
+    Any template that still asks for a VC3 client fails loudly instead of
+    making a blocking infoservice call per rendered row.
+    """
+    raise RuntimeError('VC3 client calls are not allowed while rendering '
+                       'templates; resolve the data in the view')
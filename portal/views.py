@@ -1,8 +1,8 @@
 import base64
+import copy
 import traceback
 import sys
 import time
-import subprocess
 
 from datetime import datetime, timedelta, tzinfo
 # from dateutil import tz
@@ -13,10 +13,18 @@ from flask import (flash, redirect, render_template, request,
                    session, url_for)
 
 
-from portal import app, pages
+from portal import app, pages, articles
 from portal.decorators import authenticated, allocation_validated, project_exists
 from portal.utils import (load_portal_client, get_safe_redirect,
-                          get_vc3_client, project_validated, project_in_vc, get_proxy_expiration_time)
+                          get_vc3_client, project_validated, project_in_vc,
+                          get_proxy_expiration_time, get_proxy_expiration,
+                          fetch_concurrently,
+                          builder_catalog, page_cache, oidc_keys,
+                          login_timings, token_revoker, user_directory)
+from portal.view_models import (request_rows, resource_rows,
+                                environment_rows)
+from portal.conditional import conditional_response, session_etag
+from portal.proxy_expiration import epoch_seconds
 
 from vc3infoservice.core import InfoEntityExistsException
 
@@ -81,12 +89,14 @@ def missing_object_error_page(e):
 
 
 @app.route('/', methods=['GET'])
+@page_cache.public()
 def home():
     """Home page - play with it if you must!"""
     return render_template('home.html')
 
 
 @app.route('/status', methods=['GET', 'POST'])
+@page_cache.public()
 def status():
     """Status page - to display System Operational Status"""
     return render_template('status.html')
@@ -96,17 +106,16 @@ def status():
 # -----------------------------------------
 
 
+# Number of most recent articles shown on /blog
+LATEST_ARTICLES = 20
+
+
 @app.route('/blog', methods=['GET'])
 def blog():
     """Articles are pages with a publication date"""
-    articles = (p for p in pages if 'date' in p.meta)
-    """Show the 10 most recent articles, most recent first"""
-    latest = sorted(articles, reverse=True, key=lambda p: p.meta['date'])
-    blog_pages = latest[:20]
-    taglist = []
-    for p in blog_pages:
-        if p.meta['tags'][0] not in taglist:
-            taglist.append(p.meta['tags'][0])
+    """Show the most recent articles, most recent first"""
+    blog_pages = articles.latest(LATEST_ARTICLES)
+    taglist = articles.sidebar(LATEST_ARTICLES)
     """Send the user to the blog page"""
     return render_template('blog.html', pages=blog_pages, taglist=taglist)
 
@@ -114,7 +123,7 @@ def blog():
 @app.route('/blog/tag/<string:tag>/', methods=['GET'])
 def tag(tag):
     """Automatic routing and compiling for article tags"""
-    tagged = [p for p in pages if tag in p.meta.get('tags', [])]
+    tagged = articles.tagged(tag)
     return render_template('blog_tag.html', pages=tagged, tag=tag)
 
 
@@ -126,27 +135,31 @@ def page(path):
 
 
 @app.route('/resources', methods=['GET'])
+@page_cache.public('resource', 'nodeinfo')
 def list_home_resources():
     """ Route for HPC and Resources List View """
     vc3_client = get_vc3_client()
-    resources = vc3_client.listResources()
+    resources = resource_rows(vc3_client, vc3_client.listResources())
 
     return render_template('home_resource.html', resources=resources)
 
 
 @app.route('/community', methods=['GET'])
+@page_cache.public()
 def community():
     """Send the user to community page"""
     return render_template('community.html')
 
 
 @app.route('/documentations', methods=['GET'])
+@page_cache.public()
 def documentations():
     """Send the user to documentations page"""
     return render_template('documentations.html')
 
 
 @app.route('/team', methods=['GET'])
+@page_cache.public()
 def team():
     """Send the user to team page"""
     return render_template('team.html')
@@ -168,23 +181,19 @@ def login():
 @authenticated
 def logout():
     """
-    - Revoke the tokens with Globus Auth.
+    - Queue the tokens for revocation with Globus Auth.
     - Destroy the session state.
     - Redirect the user to the Globus Auth logout page.
     """
-    globusclient = load_portal_client()
-
-    # Revoke the tokens with Globus Auth
-    for token, token_type in (
-            (token_info[ty], ty)
-            # get all of the token info dicts
-            for token_info in session['tokens'].values()
-            # cross product with the set of token types
-            for ty in ('access_token', 'refresh_token')
-            # only where the relevant token is actually present
-            if token_info[ty] is not None):
-        globusclient.oauth2_revoke_token(
-            token, additional_params={'token_type_hint': token_type})
+    # Revoke the tokens with Globus Auth, in the background
+    token_revoker.submit(
+        (token_info[ty], ty)
+        # get all of the token info dicts
+        for token_info in session['tokens'].values()
+        # cross product with the set of token types
+        for ty in ('access_token', 'refresh_token')
+        # only where the relevant token is actually present
+        if token_info[ty] is not None)
 
     # Destroy the session state
     session.clear()
@@ -208,16 +217,12 @@ def show_profile_page():
     """User profile information. Assocated with a Globus Auth identity."""
 
     vc3_client = get_vc3_client()
-    userlist = vc3_client.listUsers()
 
     if request.method == 'GET':
-        profile = None
         sshpubstring = None
         name = None
 
-        for user in userlist:
-            if session['primary_identity'] == user.identity_id:
-                profile = user
+        profile = user_directory.get(vc3_client, session['primary_identity'])
 
         if profile:
 
@@ -242,8 +247,7 @@ def show_profile_page():
         if request.args.get('next'):
             session['next'] = get_safe_redirect()
 
-        return render_template('profile.html', userlist=userlist,
-                               profile=profile, name=name)
+        return render_template('profile.html', profile=profile, name=name)
     elif request.method == 'POST':
         first = request.form['first']
         last = request.form['last']
@@ -271,7 +275,7 @@ def show_profile_page():
                                             displayname=displayname,
                                             sshpubstring=sshpubstring)
 
-            vc3_client.storeUser(newuser)
+            user_directory.store(vc3_client, newuser)
         except InfoEntityExistsException:
             flash('That username has already been chosen please choose another'
                   ' username', 'warning')
@@ -325,7 +329,7 @@ def edit_profile(name):
         LookupError('user')
 
     # Store user new attributes into infoservice
-    vc3_client.storeUser(profile)
+    user_directory.store(vc3_client, profile)
     # Redirect to updated  profile page
     flash('Your profile has been successfully updated', 'success')
     return redirect(url_for('show_profile_page'))
@@ -363,9 +367,15 @@ def authcallback():
         # If we do have a "code" param, we're coming back from Globus Auth
         # and can start the process of exchanging an auth code for a token.
         code = request.args.get('code')
-        tokens = globusclient.oauth2_exchange_code_for_tokens(code)
-
-        id_token = tokens.decode_id_token(globusclient)
+        timer = login_timings.start()
+        with timer.phase('exchange_code'):
+            tokens = globusclient.oauth2_exchange_code_for_tokens(code)
+
+        with timer.phase('id_token'):
+            id_token = oidc_keys.decode_id_token(tokens, globusclient)
+        timer.label = id_token.get('preferred_username', '')
+        # a new session id for the logged in user
+        session.regenerate()
         session.update(
             tokens=tokens.by_resource_server,
             is_authenticated=True,
@@ -376,11 +386,13 @@ def authcallback():
             primary_identity=id_token.get('sub')
         )
         vc3_client = get_vc3_client()
-        userlist = vc3_client.listUsers()
-        profile = None
+        with timer.phase('user_lookup'):
+            profile = user_directory.get(vc3_client, id_token.get('sub'))
 
-        ids = globusclient.get_identities(
-            usernames=id_token.get('preferred_username', ''))
+        with timer.phase('identities'):
+            ids = globusclient.get_identities(
+                usernames=id_token.get('preferred_username', ''))
+        timer.finish()
 
         email = id_token.get('email', '')
         # print("HOOOOMG")
@@ -399,10 +411,6 @@ def authcallback():
         if not (email.split("@")[-1].split(".")[-1] in ["edu", "gov", "org", "ch", 'com']):
             return render_template('email_error.html')
 
-        for user in userlist:
-            if session['primary_identity'] == user.identity_id:
-                profile = user
-
         if profile:
 
             session['name'] = profile.name
@@ -445,17 +453,13 @@ def whitelist_error():
 def portal():
     """Send the existing user to Portal Home."""
     vc3_client = get_vc3_client()
-    userlist = vc3_client.listUsers()
     resources = vc3_client.listResources()
 
     if request.method == 'GET':
-        profile = None
         sshpubstring = None
         name = None
 
-        for user in userlist:
-            if session['primary_identity'] == user.identity_id:
-                profile = user
+        profile = user_directory.get(vc3_client, session['primary_identity'])
 
         if profile:
 
@@ -480,7 +484,7 @@ def portal():
         if request.args.get('next'):
             session['next'] = get_safe_redirect()
 
-        return render_template('portal_home.html', userlist=userlist,
+        return render_template('portal_home.html',
                                profile=profile, name=name,
                                sshpubstring=sshpubstring, resources=resources)
 
@@ -545,7 +549,10 @@ def list_projects():
     users = vc3_client.listUsers()
     allocations = vc3_client.listAllocations()
 
-    return render_template('project.html', projects=projects, users=users, allocations=allocations)
+    etag = session_etag(projects, users, allocations)
+    return conditional_response(etag, lambda: render_template(
+        'project.html', projects=projects, users=users,
+        allocations=allocations))
 
 
 @app.route('/project/<name>', methods=['GET'])
@@ -564,13 +571,17 @@ def view_project(name):
         return redirect(url_for('list_projects'))
 
     vc3_client = get_vc3_client()
-    projects = vc3_client.listProjects()
-    allocations = vc3_client.listAllocations()
-    users = vc3_client.listUsers()
-    requests = vc3_client.listRequests()
+    # independent collections, fetched at once; nodesets answer the
+    # getNodeset calls below
+    projects, allocations, users, requests, nodesets = fetch_concurrently(
+        'listProjects', 'listAllocations', 'listUsers', 'listRequests',
+        'listNodesets')
+
     project = None
     headnode = None
 
+    # requests is the shared cache snapshot; the headnodes go on copies
+    vc3_requests = []
     for vc3_request in requests:
         if vc3_request.headnode:
             try:
@@ -578,7 +589,9 @@ def view_project(name):
             except:
                 pass
         # use headnode structure in the profile.
+        vc3_request = copy.copy(vc3_request)
         vc3_request.headnode = headnode
+        vc3_requests.append(vc3_request)
     # Scanning list of projects and matching with name of project argument
 
     project = vc3_client.getProject(projectname=name)
@@ -592,7 +605,8 @@ def view_project(name):
         return render_template('projects_pages.html', name=name, owner=owner,
                                members=members, allocations=allocations,
                                projects=projects, users=users, project=project,
-                               description=description, requests=requests)
+                               description=description,
+                               requests=vc3_requests)
     app.logger.error("Could not find project when viewing: {0}".format(name))
     raise LookupError('project')
 
@@ -613,18 +627,18 @@ def add_member_to_project(name):
 
     user = request.form['newuser']
 
-    for project in projects:
-        if project.name == name:
-            name = project.name
-            if project.owner == user:
-                flash('User is already the project owner.', 'warning')
-                app.logger.error("Trying to add owner as member:" +
-                                 "owner: {0} project:{1}".format(user, name))
-                return redirect(url_for('view_project', name=name))
-            for selected_member in request.form.getlist('newuser'):
-                vc3_client.addUserToProject(project=name, user=selected_member)
-            flash('Successfully added member to project.', 'success')
+    project = projects.get(name)
+    if project is not None:
+        name = project.name
+        if project.owner == user:
+            flash('User is already the project owner.', 'warning')
+            app.logger.error("Trying to add owner as member:" +
+                             "owner: {0} project:{1}".format(user, name))
             return redirect(url_for('view_project', name=name))
+        for selected_member in request.form.getlist('newuser'):
+            vc3_client.addUserToProject(project=name, user=selected_member)
+        flash('Successfully added member to project.', 'success')
+        return redirect(url_for('view_project', name=name))
     app.logger.error("Could not find project when adding user: " +
                      "user: {0} project:{1}".format(user, name))
     flash('Project not found, can\'t add user', 'warning')
@@ -680,15 +694,15 @@ def add_allocation_to_project(name):
 
     # new_allocation = request.form['allocation']
 
-    for project in projects:
-        if project.name == name:
-            name = project.name
-            allocationhash = (str(name) + '#' + 'project-allocations')
-            for selected_allocation in request.form.getlist('allocation'):
-                vc3_client.addAllocationToProject(allocation=selected_allocation,
-                                                  projectname=name)
-            flash('Successfully added allocation to project.', 'success')
-            return redirect(url_for('view_project', name=name))
+    project = projects.get(name)
+    if project is not None:
+        name = project.name
+        allocationhash = (str(name) + '#' + 'project-allocations')
+        for selected_allocation in request.form.getlist('allocation'):
+            vc3_client.addAllocationToProject(allocation=selected_allocation,
+                                              projectname=name)
+        flash('Successfully added allocation to project.', 'success')
+        return redirect(url_for('view_project', name=name))
     app.logger.error("Could not find project when adding allocation: " +
                      "alloc: {0} project:{1}".format(new_allocation, name))
     flash('Project not found, could not add allocation to project', 'warning')
@@ -822,10 +836,8 @@ def view_cluster(name):
     :return: Cluster Template profile view specific to cluster name
     """
     vc3_client = get_vc3_client()
-    clusters = vc3_client.listClusters()
-    projects = vc3_client.listProjects()
-    nodesets = vc3_client.listNodesets()
-    users = vc3_client.listUsers()
+    clusters, projects, nodesets, users = fetch_concurrently(
+        'listClusters', 'listProjects', 'listNodesets', 'listUsers')
     cluster = None
 
     cluster = vc3_client.getCluster(clustername=name)
@@ -861,24 +873,25 @@ def edit_cluster(name):
     frameworks = []
 
     if request.method == 'GET':
-        for cluster in clusters:
-            if cluster.name == name:
-                clustername = cluster.name
-                owner = cluster.owner
-                state = cluster.state
-                # description = cluster.description
-        for nodeset in nodesets:
-            if nodeset.name == name:
-                node_number = nodeset.node_number
-                framework = nodeset.app_type
-                if nodeset.app_type not in frameworks:
-                    frameworks.append(nodeset.app_type)
-
-                return render_template('cluster_edit.html', name=clustername,
-                                       owner=owner, nodesets=nodesets,
-                                       state=state, projects=projects,
-                                       frameworks=frameworks, node_number=node_number,
-                                       framework=framework)
+        cluster = clusters.get(name)
+        if cluster is not None:
+            clustername = cluster.name
+            owner = cluster.owner
+            state = cluster.state
+            # description = cluster.description
+        nodeset = nodesets.get(name)
+        if nodeset is not None:
+            node_number = nodeset.node_number
+            framework = nodeset.app_type
+            if nodeset.app_type not in frameworks:
+                frameworks.append(nodeset.app_type)
+
+            return render_template('cluster_edit.html', name=clustername,
+                                   owner=owner, nodesets=nodesets,
+                                   state=state, projects=projects,
+                                   frameworks=frameworks,
+                                   node_number=node_number,
+                                   framework=framework)
         app.logger.error(
             "Could not find cluster when editing: {0}".format(name))
         raise LookupError('cluster')
@@ -946,20 +959,18 @@ def delete_cluster(name):
 @authenticated
 def list_allocations():
     """ List Allocations Page """
-    vc3_client = get_vc3_client()
-    allocations = vc3_client.listAllocations()
-    resources = vc3_client.listResources()
-    projects = vc3_client.listProjects()
-    users = vc3_client.listUsers()
+    allocations, resources, projects, users = fetch_concurrently(
+        'listAllocations', 'listResources', 'listProjects', 'listUsers')
     allocation_list = []
 
     for allocation in allocations:
         if allocation.owner == session['name']:
             allocation_list.append(str(allocation.name))
 
-    return render_template('allocation.html', allocations=allocations,
-                           resources=resources, users=users, projects=projects,
-                           allocationlist=allocation_list)
+    etag = session_etag(allocations, resources, users, projects)
+    return conditional_response(etag, lambda: render_template(
+        'allocation.html', allocations=allocations, resources=resources,
+        users=users, projects=projects, allocationlist=allocation_list))
 
 
 @app.route('/allocation/new', methods=['GET', 'POST'])
@@ -1111,11 +1122,14 @@ def view_allocation(name):
         pubtokendocurl = allocation.pubtokendocurl
 
         if allocation_resource.accessmethod in ('gsissh', 'sshproxy'):
-            privtoken = base64.b64decode(allocation.privtoken)
-            expiration = get_proxy_expiration_time(privtoken,
+            # parsed once per token, only the time left is computed here
+            expiration = get_proxy_expiration_time(allocation.privtoken,
                                                    allocation_resource.accessmethod)
+            expires_at = epoch_seconds(get_proxy_expiration(
+                allocation.privtoken, allocation_resource.accessmethod))
         else:
             expiration = None
+            expires_at = None
 
         if encodedpubtoken is None:
             pubtoken = 'None'
@@ -1131,7 +1145,9 @@ def view_allocation(name):
                                    accountname=accountname,
                                    pubtoken=pubtoken, state=state,
                                    resources=resources, displayname=displayname,
-                                   users=users, accesshost=accesshost, expiration=expiration)
+                                   users=users, accesshost=accesshost,
+                                   expiration=expiration,
+                                   expires_at=expires_at)
         else:
             return render_template('allocation_profile_specific.html',
                                    name=allocationname,
@@ -1140,7 +1156,9 @@ def view_allocation(name):
                                    pubtoken=pubtoken, state=state,
                                    resources=resources, displayname=displayname,
                                    users=users, accesshost=accesshost,
-                                   pubtokendocurl=pubtokendocurl, expiration=expiration)
+                                   pubtokendocurl=pubtokendocurl,
+                                   expiration=expiration,
+                                   expires_at=expires_at)
         app.logger.error(
             "Could not find allocation when viewing: {0}".format(name))
         raise LookupError('allocation')
@@ -1149,26 +1167,26 @@ def view_allocation(name):
         # Iterate through allocations list in infoservice for allocation
         # with the matching name argument and update with new form input
 
-        for allocation in allocations:
-            if allocation.name == name:
-                allocationname = allocation.name
-                owner = allocation.owner
-                resource = request.form['resource']
-                accountname = request.form['accountname']
-                # displayname = request.form['displayname']
-                # description_input = request.form['description']
-                # description = str(description_input)
-
-                newallocation = vc3_client.defineAllocation(name=allocationname,
-                                                            owner=owner,
-                                                            resource=resource,
-                                                            accountname=accountname)
-                vc3_client.storeAllocation(newallocation)
-                # flash('Allocation created', 'success')
-                return render_template('allocation_profile.html', name=allocationname,
-                                       owner=owner, accountname=accountname,
-                                       resource=resource, allocations=allocations,
-                                       resources=resources)
+        allocation = allocations.get(name)
+        if allocation is not None:
+            allocationname = allocation.name
+            owner = allocation.owner
+            resource = request.form['resource']
+            accountname = request.form['accountname']
+            # displayname = request.form['displayname']
+            # description_input = request.form['description']
+            # description = str(description_input)
+
+            newallocation = vc3_client.defineAllocation(
+                name=allocationname, owner=owner, resource=resource,
+                accountname=accountname)
+            vc3_client.storeAllocation(newallocation)
+            # flash('Allocation created', 'success')
+            return render_template('allocation_profile.html',
+                                   name=allocationname,
+                                   owner=owner, accountname=accountname,
+                                   resource=resource, allocations=allocations,
+                                   resources=resources)
 
 
 @app.route('/allocation/<name>/validate', methods=['GET', 'POST'])
@@ -1276,7 +1294,7 @@ def delete_allocation(name):
 def list_resources():
     """ Route for HPC and Resources List View """
     vc3_client = get_vc3_client()
-    resources = vc3_client.listResources()
+    resources = resource_rows(vc3_client, vc3_client.listResources())
 
     return render_template('resource.html', resources=resources)
 
@@ -1335,12 +1353,13 @@ def admin():
         vc3_client = get_vc3_client()
         vc3_requests = vc3_client.listRequests()
         nodesets = vc3_client.listNodesets()
-        clusters = vc3_client.listClusters
+        clusters = vc3_client.listClusters()
         request_list = []
 
         for vc3_request in vc3_requests:
             request_list.append(str(vc3_request.name))
 
+        vc3_requests = request_rows(vc3_requests, nodesets, clusters)
         return render_template('admin.html', requests=vc3_requests,
                                nodesets=nodesets, clusters=clusters,
                                requestlist=request_list)
@@ -1356,16 +1375,13 @@ def list_requests():
     vc3_requests = vc3_client.listRequests()
     nodesets = vc3_client.listNodesets()
     clusters = vc3_client.listClusters()
+    # prefetch once and join in memory rather than fetching per VC
+    vc3_projects = vc3_client.listProjects()
     request_list = []
     projects = []
 
     for vc3_request in vc3_requests:
-        vc_projectname = vc3_request.project
-        try:
-            associated_project = vc3_client.getProject(
-                projectname=vc_projectname)
-        except:
-            associated_project = None
+        associated_project = vc3_projects.get(vc3_request.project)
 
         if vc3_request.owner == session['name']:
             request_list.append(str(vc3_request.name))
@@ -1374,27 +1390,13 @@ def list_requests():
             if session['name'] in associated_project.members:
                 request_list.append(str(vc3_request.name))
 
-        headnode = None
-        if vc3_request.headnode:
-            try:
-                headnode = vc3_client.getNodeset(vc3_request.headnode)
-            except:
-                pass
-        # use headnode structure in the profile.
-        vc3_request.headnode = headnode
+    # use headnode structure in the profile
+    vc3_requests = request_rows(vc3_requests, nodesets, clusters)
 
-        # convert expiration to readable format
-        expiration_utc = vc3_request.expiration
-        local_timezone = tzlocal.get_localzone()  # get pytz tzinfo
-        utc_time = datetime.strptime(expiration_utc, '%Y-%m-%dT%H:%M:%S')
-        local_time = utc_time.replace(
-            tzinfo=pytz.utc).astimezone(local_timezone)
-        # time_difference = expiration_utc - datetime.now()
-        local_time = local_time.strftime('%m/%d - %H:%M %Z')
-
-    return render_template('request.html', requests=vc3_requests,
-                           nodesets=nodesets, clusters=clusters,
-                           requestlist=request_list, projects=projects)
+    etag = session_etag(vc3_requests, nodesets, clusters, vc3_projects)
+    return conditional_response(etag, lambda: render_template(
+        'request.html', requests=vc3_requests, nodesets=nodesets,
+        clusters=clusters, requestlist=request_list, projects=projects))
 
 
 @app.route('/request/new', methods=['GET', 'POST'])
@@ -1427,9 +1429,11 @@ def create_request(project):
     """
     vc3_client = get_vc3_client()
     if request.method == 'GET':
-        clusters = vc3_client.listClusters()
-        projects = vc3_client.listProjects()
-        environments = vc3_client.listEnvironments()
+        # the project and its allocations are then looked up in the
+        # fetched collections
+        clusters, projects, environments, _ = fetch_concurrently(
+            'listClusters', 'listProjects', 'listEnvironments',
+            'listAllocations')
         get_project = vc3_client.getProject(projectname=project)
         project = get_project.name
         allocations = []
@@ -1551,12 +1555,11 @@ def view_request(name):
     """
 
     vc3_client = get_vc3_client()
-    vc3_requests = vc3_client.listRequests()
-    nodesets = vc3_client.listNodesets()
-    clusters = vc3_client.listClusters()
-    users = vc3_client.listUsers()
+    # projects are fetched along for the membership check
+    vc3_requests, nodesets, clusters, users, allocations, _ = \
+        fetch_concurrently('listRequests', 'listNodesets', 'listClusters',
+                           'listUsers', 'listAllocations', 'listProjects')
     vc3_request = None
-    allocations = vc3_client.listAllocations()
 
     if request.method == 'GET':
         # Checks if user is member of project associated with Virtual Cluster
@@ -1605,6 +1608,9 @@ def view_request(name):
             # for user in users:
             #     if user.name == owner:
             #         profile = user
+            clusterinfo = clusters.get(vc3_request.cluster)
+            environments = environment_rows(vc3_client,
+                                            vc3_request.environments)
 
             return render_template('request_profile.html', name=requestname,
                                    owner=owner, requests=vc3_requests,
@@ -1616,7 +1622,9 @@ def view_request(name):
                                    description=description,
                                    profile=profile, vc3_request=vc3_request,
                                    displayname=displayname,
-                                   expiration=local_time, headnode=headnode)
+                                   expiration=local_time, headnode=headnode,
+                                   clusterinfo=clusterinfo,
+                                   environments=environments)
 
         app.logger.error("Could not find VC when viewing: {0}".format(name))
         raise LookupError('virtual cluster')
@@ -1624,15 +1632,15 @@ def view_request(name):
     elif request.method == 'POST':
         # Method to terminate running a specific Virtual Cluster
         # based on name argument that is passed through
-        for vc3_request in vc3_requests:
-            if vc3_request.name == name:
-                requestname = vc3_request.name
+        vc3_request = vc3_requests.get(name)
+        if vc3_request is not None:
+            requestname = vc3_request.name
 
-                vc3_client.terminateRequest(requestname=requestname)
+            vc3_client.terminateRequest(requestname=requestname)
 
-                # flash('Your Virtual Cluster has begun termination.',
-                # 'success')
-                return redirect(url_for('view_request', name=requestname))
+            # flash('Your Virtual Cluster has begun termination.',
+            # 'success')
+            return redirect(url_for('view_request', name=requestname))
         flash('Could not find specified Virtual Cluster', 'warning')
         app.logger.error(
             "Could not find VC when terminating: {0}".format(name))
@@ -1705,10 +1713,11 @@ def resize_request(name):
 
     elif request.method == 'POST':
         node_number = request.form['node_number']
-        for nodeset in nodesets:
-            if nodeset.displayname == name:
-                nodeset.node_number = node_number
-                vc3_client.storeNodeset(nodeset)
+        for nodeset in nodesets.filter_by('displayname', name):
+            # listed nodesets are shared; change a copy
+            nodeset = copy.deepcopy(nodeset)
+            nodeset.node_number = node_number
+            vc3_client.storeNodeset(nodeset)
     return redirect(url_for('view_request', name=name))
 
 
@@ -1769,9 +1778,8 @@ def list_environments():
     """ List View of Environments """
     vc3_client = get_vc3_client()
     environments = vc3_client.listEnvironments()
-    # Call list of build recipes from vc3-builder
-    recipes = subprocess.check_output(["/usr/bin/vc3-builder", "--list"])
-    recipe_list = recipes.split()
+    # List of build recipes from vc3-builder
+    recipe_list = builder_catalog.get().recipes
 
     return render_template('environments.html', recipes=recipe_list,
                            environments=environments)
@@ -1782,12 +1790,8 @@ def list_environments():
 def create_environment():
     """ New Environment Creation Form """
     vc3_client = get_vc3_client()
-    recipes = subprocess.check_output(["/usr/bin/vc3-builder", "--list"])
-    recipe_list = recipes.split()
-
-    recipes_section = subprocess.check_output(
-        ["/usr/bin/vc3-builder", "--list=section"])
-    recipe_list_section = recipes_section.split()
+    catalog = builder_catalog.get()
+    recipe_list = catalog.recipes
 
     # expected_sections = ["--- bioinformatics tools", "--- compilation tools",
     # "--- data management tools", "--- data transfer tools", "--- databases",
@@ -1797,14 +1801,13 @@ def create_environment():
     # "--- python packages", "--- scripting languages", "--- software building",
     # "--- source version control", "--- workflow tools"]
 
-    oss = subprocess.check_output(["/usr/bin/vc3-builder", "--list=os"])
-    os_list = oss.split()
+    os_list = catalog.oss
 
     if request.method == 'GET':
         environments = vc3_client.listEnvironments()
         return render_template('environment_new.html',
                                environments=environments, recipes=recipe_list,
-                               recipe_list_section=recipes_section, oss=os_list)
+                               oss=os_list)
 
     elif request.method == 'POST':
         # Gathering and storing information from new allocation form
@@ -1917,8 +1920,7 @@ def edit_environment_os(name):
     """
     vc3_client = get_vc3_client()
 
-    oss = subprocess.check_output(["/usr/bin/vc3-builder", "--list=os"])
-    os_list = oss.split()
+    os_list = builder_catalog.get().oss
 
     if request.method == 'GET':
         environment = vc3_client.getEnvironment(environmentname=name)
@@ -0,0 +1,84 @@
+import copy
+import os
+import threading
+
+from collections import OrderedDict
+
+# importing any portal module loads the app's config; use the tests' own
+os.environ.setdefault('VC3_PORTAL_CONFIG', os.path.join(
+    os.path.dirname(os.path.abspath(__file__)), 'portal.conf'))
+
+
+class Entity(object):
+    """
+    VC3 entity with a name and whatever other fields a test needs
+    """
+
+    def __init__(self, name, **fields):
+        self.name = name
+        self.__dict__.update(fields)
+
+
+class FakeVC3Client(object):
+    """
+    Stands in for VC3ClientAPI, keeping entities in memory
+
+    Supports list*, get*, store* and delete* of any kind, e.g.
+    listProjects(), getUser(name), storeUser(user) and deleteRequest(name),
+    each handing out or keeping copies like the infoservice would.  Every
+    call is recorded in calls.
+    """
+
+    def __init__(self, **entities):
+        """
+        :param entities: kind to list of entities, e.g. user=[...]
+        """
+        self.entities = {}
+        self.calls = []
+        for kind, values in entities.items():
+            self.entities[kind] = OrderedDict((e.name, e) for e in values)
+
+    def __getattr__(self, attr):
+        for prefix in ('list', 'get', 'store', 'delete'):
+            if attr.startswith(prefix) and len(attr) > len(prefix):
+                kind = attr[len(prefix):].lower()
+                break
+        else:
+            raise AttributeError(attr)
+        if prefix == 'list':
+            kind = kind[:-1]
+        entities = self.entities.setdefault(kind, OrderedDict())
+
+        def call(*args, **kwargs):
+            self.calls.append(attr)
+            if prefix == 'list':
+                return [copy.deepcopy(e) for e in entities.values()]
+            arg = args[0] if args else list(kwargs.values())[0]
+            if prefix == 'get':
+                return copy.deepcopy(entities.get(arg))
+            if prefix == 'delete':
+                entities.pop(arg, None)
+            else:
+                entities[arg.name] = copy.deepcopy(arg)
+        return call
+
+
+class FakeAuthClient(object):
+    """
+    Stands in for ConfidentialAppAuthClient, recording revoked tokens
+
+    The first failures revocations raise IOError, like an unreachable
+    Globus Auth would.
+    """
+
+    def __init__(self, failures=0):
+        self.failures = failures
+        self.revoked = []
+        self._lock = threading.Lock()
+
+    def oauth2_revoke_token(self, token, additional_params=None):
+        with self._lock:
+            if self.failures:
+                self.failures -= 1
+                raise IOError('auth.globus.org unreachable')
+            self.revoked.append(token)
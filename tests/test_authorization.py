@@ -0,0 +1,43 @@
+import unittest
+
+from portal.authorization import Authorizer
+from portal.client_cache import EntityCache, SharedCacheClient
+from tests import Entity, FakeVC3Client
+
+
+class AuthorizerTest(unittest.TestCase):
+
+    def setUp(self):
+        self.backend = FakeVC3Client(
+            project=[Entity('p1', owner='alice', members=['bob']),
+                     Entity('p2', owner='carol', members=[])],
+            allocation=[Entity('alice.res1', owner='alice', state='ready')],
+            request=[Entity('vc1', owner='alice')])
+        self.cache = EntityCache(default_ttl=60)
+        self.client = SharedCacheClient(self.backend, self.cache)
+        self.authorizer = Authorizer(self.cache)
+
+    def test_grants(self):
+        self.assertTrue(self.authorizer.in_project(self.client, 'bob', 'p1'))
+        self.assertFalse(self.authorizer.in_project(self.client, 'bob',
+                                                    'p2'))
+        self.assertTrue(self.authorizer.has_ready_allocation(self.client,
+                                                             'alice'))
+        self.assertFalse(self.authorizer.has_ready_allocation(self.client,
+                                                              'bob'))
+        self.assertEqual(self.authorizer.stats()['builds'], 1)
+
+    def test_membership_change_rebuilds(self):
+        self.assertFalse(self.authorizer.in_project(self.client, 'dave',
+                                                    'p2'))
+        self.client.storeProject(Entity('p2', owner='carol',
+                                        members=['dave']))
+        self.assertTrue(self.authorizer.in_project(self.client, 'dave',
+                                                   'p2'))
+
+    def test_reused_vc_name_checks_the_new_owner(self):
+        self.assertTrue(self.authorizer.in_vc(self.client, 'bob', 'vc1'))
+        self.client.deleteRequest('vc1')
+        self.client.storeRequest(Entity('vc1', owner='carol'))
+        self.assertFalse(self.authorizer.in_vc(self.client, 'bob', 'vc1'))
+        self.assertTrue(self.authorizer.in_vc(self.client, 'carol', 'vc1'))
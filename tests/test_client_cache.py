@@ -0,0 +1,117 @@
+import copy
+import unittest
+
+from portal.client_cache import (EntityCache, EntityCollection,
+                                 SharedCacheClient)
+from tests import Entity, FakeVC3Client
+
+
+class EntityCacheTest(unittest.TestCase):
+
+    def test_put_after_invalidate_is_dropped(self):
+        cache = EntityCache(default_ttl=60)
+        generation = cache.generation('project')
+        cache.invalidate('project')
+        self.assertNotEqual(generation, cache.generation('project'))
+        cache.put('project', None, ['old'], generation)
+        self.assertEqual(cache.get('project', None), (False, None))
+        cache.put('project', None, ['new'], cache.generation('project'))
+        self.assertEqual(cache.get('project', None), (True, ['new']))
+
+    def test_invalidate_only_touches_its_kind(self):
+        cache = EntityCache(default_ttl=60)
+        cache.put('project', None, ['p'])
+        cache.put('user', None, ['u'])
+        user_generation = cache.generation('user')
+        cache.invalidate('project')
+        self.assertEqual(cache.get('project', None), (False, None))
+        self.assertEqual(cache.get('user', None), (True, ['u']))
+        self.assertEqual(cache.generation('user'), user_generation)
+
+    def test_ttls(self):
+        cache = EntityCache(ttls={'project': 0}, default_ttl=5)
+        self.assertEqual(cache.ttl('project'), 0)
+        self.assertEqual(cache.ttl('user'), 5)
+        cache.put('project', None, ['p'])
+        cache.put('user', None, ['u'])
+        self.assertEqual(cache.get('project', None), (False, None))
+        self.assertEqual(cache.get('user', None), (True, ['u']))
+
+    def test_list_ttls(self):
+        cache = EntityCache(ttls={'project': 10}, default_ttl=5,
+                            list_ttls={'project': 0})
+        self.assertEqual(cache.ttl('project'), 0)
+        self.assertEqual(cache.ttl('project', 'p1'), 10)
+        cache.put('project', None, ['p'])
+        cache.put('project', 'p1', 'p')
+        self.assertEqual(cache.get('project', None), (False, None))
+        self.assertEqual(cache.get('project', 'p1'), (True, 'p'))
+
+    def test_evicts_least_recently_used(self):
+        cache = EntityCache(default_ttl=60, max_entries=2)
+        cache.put('project', 'a', 1)
+        cache.put('project', 'b', 2)
+        cache.get('project', 'a')
+        cache.put('project', 'c', 3)
+        self.assertEqual(cache.get('project', 'b'), (False, None))
+        self.assertEqual(cache.get('project', 'a'), (True, 1))
+        self.assertEqual(cache.stats()['evictions'], 1)
+
+
+class EntityCollectionTest(unittest.TestCase):
+
+    def setUp(self):
+        self.projects = EntityCollection([Entity('p1', owner='alice'),
+                                          Entity('p2', owner='bob'),
+                                          Entity('p3', owner='alice')])
+
+    def test_indexes(self):
+        self.assertEqual(self.projects.get('p2').owner, 'bob')
+        self.assertIsNone(self.projects.get('p4'))
+        self.assertEqual([p.name for p in
+                          self.projects.filter_by('owner', 'alice')],
+                         ['p1', 'p3'])
+
+    def test_deepcopy_keeps_indexes(self):
+        self.projects.get('p1')
+        self.projects.filter_by('owner', 'alice')
+        copied = copy.deepcopy(self.projects)
+        self.assertIsInstance(copied, EntityCollection)
+        self.assertIsNot(copied[0], self.projects[0])
+        self.assertEqual(sorted(copied._indexes), ['name', 'owner'])
+        # the copied indexes point at the copied entities
+        self.assertIs(copied.get('p1'), copied[0])
+        self.assertIs(copied.filter_by('owner', 'alice')[1], copied[2])
+
+
+class SharedCacheClientTest(unittest.TestCase):
+
+    def setUp(self):
+        self.backend = FakeVC3Client(project=[Entity('p1', owner='alice'),
+                                              Entity('p2', owner='bob')])
+        self.cache = EntityCache(default_ttl=60)
+        self.client = SharedCacheClient(self.backend, self.cache)
+
+    def test_lists_share_one_snapshot(self):
+        first = self.client.listProjects()
+        second = self.client.listProjects()
+        self.assertIs(first, second)
+        self.assertEqual(second.get('p2').owner, 'bob')
+        self.assertEqual(self.backend.calls, ['listProjects'])
+
+    def test_get_copies_from_the_snapshot(self):
+        projects = self.client.listProjects()
+        project = self.client.getProject('p1')
+        self.assertEqual(self.backend.calls, ['listProjects'])
+        project.owner = 'mallory'
+        self.assertEqual(projects.get('p1').owner, 'alice')
+        self.assertEqual(self.client.getProject('p1').owner, 'alice')
+
+    def test_write_invalidates(self):
+        self.client.listProjects()
+        generation = self.cache.generation('project')
+        self.client.storeProject(Entity('p3'))
+        self.assertEqual(self.cache.generation('project'), generation + 1)
+        self.assertEqual(len(self.client.listProjects()), 3)
+        self.assertEqual(self.backend.calls,
+                         ['listProjects', 'storeProject', 'listProjects'])
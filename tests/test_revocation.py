@@ -0,0 +1,68 @@
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+import time
+import unittest
+
+from portal.revocation import TokenRevoker
+from tests import FakeAuthClient
+
+
+class TokenRevokerTest(unittest.TestCase):
+
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+        self.backlog = os.path.join(self.root, 'backlog')
+        self.client = FakeAuthClient()
+
+    def tearDown(self):
+        shutil.rmtree(self.root)
+
+    def revoker(self, backlog_dir):
+        return TokenRevoker(lambda: self.client, backlog_dir, threads=2,
+                            retry_delay=0)
+
+    def wait_for(self, done):
+        deadline = time.time() + 5
+        while not done():
+            self.assertLess(time.time(), deadline)
+            time.sleep(0.01)
+
+    def write_job(self, token, suffix='.json'):
+        filename = hashlib.sha256(token).hexdigest() + suffix
+        with open(os.path.join(self.backlog, filename), 'w') as fh:
+            json.dump({'token': token, 'token_type': 'refresh_token',
+                       'submitted': time.time(), 'attempts': 0}, fh)
+
+    def test_resume_revokes_backlog(self):
+        os.makedirs(self.backlog, 0o700)
+        self.write_job('left-behind')
+        self.write_job('half-written', '.json.123.456.tmp')
+        revoker = self.revoker(self.backlog)
+        revoker.resume()
+        # revoked tokens are removed from the backlog after revoking
+        self.wait_for(lambda: not os.listdir(self.backlog))
+        self.assertEqual(self.client.revoked, ['left-behind'])
+
+    def test_backlog_cleared_after_retry(self):
+        self.client.failures = 1
+        revoker = self.revoker(self.backlog)
+        revoker.submit([('token', 'access_token')])
+        # the backlog directory is created for the portal's user only
+        self.assertEqual(os.stat(self.backlog).st_mode & 0o777, 0o700)
+        self.wait_for(lambda: not os.listdir(self.backlog))
+        self.assertEqual(self.client.revoked, ['token'])
+        self.assertEqual(revoker.stats()['retries'], 1)
+
+    def test_open_backlog_is_not_used(self):
+        os.makedirs(self.backlog, 0o700)
+        os.chmod(self.backlog, 0o777)
+        self.write_job('planted')
+        revoker = self.revoker(self.backlog)
+        revoker.submit([('token', 'access_token')])
+        self.assertIsNone(revoker.backlog_dir)
+        self.wait_for(lambda: revoker.stats()['revoked'] == 1)
+        self.assertEqual(self.client.revoked, ['token'])
+        self.assertEqual(len(os.listdir(self.backlog)), 1)
@@ -0,0 +1,129 @@
+import os
+import shutil
+import tempfile
+import time
+import unittest
+
+from flask import Flask, session
+
+from portal.sessions import (SessionMetrics, SessionStore,
+                             ServerSideSessionInterface, SQLiteSessionStore)
+
+
+class DictSessionStore(SessionStore):
+
+    def __init__(self):
+        self.sessions = {}
+        self.saves = 0
+
+    def load(self, sid):
+        return self.sessions.get(sid)
+
+    def save(self, sid, data, expires):
+        self.sessions[sid] = (data, expires)
+        self.saves += 1
+
+    def delete(self, sid):
+        self.sessions.pop(sid, None)
+
+
+def session_app(store):
+    app = Flask(__name__)
+    app.secret_key = 'tests'
+    app.session_interface = ServerSideSessionInterface(store,
+                                                       SessionMetrics())
+
+    @app.route('/set/<value>')
+    def set_value(value):
+        session['value'] = value
+        return ''
+
+    @app.route('/get')
+    def get_value():
+        return session.get('value', '')
+
+    @app.route('/login')
+    def login():
+        session.regenerate()
+        session['name'] = 'alice'
+        return ''
+
+    @app.route('/logout')
+    def logout():
+        session.clear()
+        return ''
+
+    return app
+
+
+class ServerSideSessionTest(unittest.TestCase):
+
+    def setUp(self):
+        self.store = DictSessionStore()
+        self.client = session_app(self.store).test_client()
+
+    def test_cookie_carries_only_the_id(self):
+        response = self.client.get('/set/secret')
+        self.assertNotIn('secret', response.headers['Set-Cookie'])
+        self.assertEqual(len(self.store.sessions), 1)
+        response = self.client.get('/get')
+        self.assertEqual(response.data, 'secret')
+        self.assertIn('Cookie', response.headers['Vary'])
+
+    def test_unchanged_session_is_not_saved(self):
+        self.client.get('/set/a')
+        response = self.client.get('/get')
+        self.assertNotIn('Set-Cookie', response.headers)
+        self.client.get('/set/a')
+        self.assertEqual(self.store.saves, 1)
+        self.client.get('/set/b')
+        self.assertEqual(self.store.saves, 2)
+
+    def test_regenerate_moves_the_session(self):
+        self.client.get('/set/a')
+        old_sid, = self.store.sessions
+        response = self.client.get('/login')
+        self.assertIn('Set-Cookie', response.headers)
+        new_sid, = self.store.sessions
+        self.assertNotEqual(new_sid, old_sid)
+        self.assertEqual(self.client.get('/get').data, 'a')
+
+    def test_clear_deletes_the_session(self):
+        self.client.get('/set/a')
+        response = self.client.get('/logout')
+        self.assertEqual(self.store.sessions, {})
+        self.assertIn('Expires=Thu, 01-Jan-1970',
+                      response.headers['Set-Cookie'])
+
+    def test_forged_cookie_gets_a_new_session(self):
+        self.client.set_cookie('localhost', 'session', 'forged.id')
+        self.assertEqual(self.client.get('/get').data, '')
+        self.client.get('/set/a')
+        self.assertEqual(len(self.store.sessions), 1)
+        self.assertNotIn('forged', list(self.store.sessions)[0])
+
+
+class SQLiteSessionStoreTest(unittest.TestCase):
+
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+        self.path = os.path.join(self.root, 'sessions.sqlite')
+
+    def tearDown(self):
+        shutil.rmtree(self.root)
+
+    def test_save_load_delete(self):
+        store = SQLiteSessionStore(self.path)
+        self.assertEqual(os.stat(self.path).st_mode & 0o777, 0o600)
+        store.save('sid', '{"name": "alice"}', time.time() + 60)
+        store.save('old', '{}', time.time() - 1)
+        self.assertEqual(store.load('sid')[0], '{"name": "alice"}')
+        self.assertIsNone(store.load('old'))
+        store.delete('sid')
+        self.assertIsNone(store.load('sid'))
+
+    def test_refuses_readable_database(self):
+        with open(self.path, 'w'):
+            pass
+        os.chmod(self.path, 0o644)
+        self.assertRaises(OSError, SQLiteSessionStore, self.path)
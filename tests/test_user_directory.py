@@ -0,0 +1,84 @@
+import unittest
+
+from portal.client_cache import EntityCache, SharedCacheClient
+from portal.user_directory import UserDirectory
+from tests import Entity, FakeVC3Client
+
+
+class UserDirectoryTest(unittest.TestCase):
+
+    def setUp(self):
+        self.backend = FakeVC3Client(user=[
+            Entity('alice', identity_id='id-a', displayname=None),
+            Entity('bob', identity_id='id-b', displayname=None)])
+        self.cache = EntityCache(default_ttl=60)
+        self.client = SharedCacheClient(self.backend, self.cache)
+        self.directory = UserDirectory(self.cache, min_refresh=30)
+
+    def lists(self):
+        return self.backend.calls.count('listUsers')
+
+    def test_lookups_share_one_index(self):
+        self.assertEqual(self.directory.get(self.client, 'id-a').name,
+                         'alice')
+        self.assertEqual(self.directory.get(self.client, 'id-b').name, 'bob')
+        self.assertEqual(self.directory.stats()['builds'], 1)
+        self.assertEqual(self.lists(), 1)
+
+    def test_get_returns_a_copy(self):
+        self.directory.get(self.client, 'id-a').displayname = 'Mallory'
+        self.assertIsNone(self.directory.get(self.client,
+                                             'id-a').displayname)
+
+    def test_store_updates_index_in_place(self):
+        self.directory.get(self.client, 'id-a')
+        self.directory.store(self.client, Entity('carol', identity_id='id-c',
+                                                 displayname='Carol'))
+        self.directory.store(self.client, Entity('alice', identity_id='id-a2',
+                                                 displayname='Alice'))
+        self.assertEqual(self.directory.get(self.client,
+                                            'id-c').displayname, 'Carol')
+        self.assertEqual(self.directory.get(self.client, 'id-a2').name,
+                         'alice')
+        self.assertEqual(self.lists(), 1)
+        self.assertEqual(self.directory.stats()['builds'], 1)
+        self.assertEqual(self.directory.stats()['users'], 3)
+
+    def test_store_after_racing_write_rebuilds(self):
+        self.directory.get(self.client, 'id-a')
+
+        class RacingClient(SharedCacheClient):
+            def storeUser(client, user):
+                # another request writes a user at the same time
+                self.cache.invalidate('user')
+                return SharedCacheClient.__getattr__(client,
+                                                     'storeUser')(user)
+
+        racing = RacingClient(self.backend, self.cache)
+        self.directory.store(racing, Entity('carol', identity_id='id-c'))
+        self.assertEqual(self.directory.stats()['users'], 0)
+        self.assertEqual(self.directory.get(self.client, 'id-c').name,
+                         'carol')
+        self.assertEqual(self.directory.stats()['builds'], 2)
+
+    def test_miss_refreshes_at_most_once_per_interval(self):
+        self.directory.get(self.client, 'id-a')
+        self.assertIsNone(self.directory.get(self.client, 'id-x'))
+        self.assertIsNone(self.directory.get(self.client, 'id-x'))
+        self.assertEqual(self.directory.stats()['refreshes'], 1)
+        self.assertEqual(self.lists(), 2)
+
+    def test_misses_of_others_do_not_delay_a_new_user(self):
+        self.assertIsNone(self.directory.get(self.client, 'id-x'))
+        # registered through another worker, whose writes this cache
+        # never saw
+        self.backend.storeUser(Entity('dave', identity_id='id-d'))
+        self.assertEqual(self.directory.get(self.client, 'id-d').name,
+                         'dave')
+        self.assertEqual(self.directory.stats()['refreshes'], 2)
+
+    def test_remembers_a_bounded_number_of_misses(self):
+        directory = UserDirectory(self.cache, max_refreshed=2)
+        for identity_id in ('id-x', 'id-y', 'id-z'):
+            directory.get(self.client, identity_id)
+        self.assertEqual(list(directory._refreshed), ['id-y', 'id-z'])